@@ -1,16 +1,56 @@
 """
 EMR Cost Optimizer - Flask Application
 """
-from flask import Flask, jsonify, render_template, request
-from services.emr_service import EMRService
+import hashlib
+import json
+from flask import Flask, Response, jsonify, render_template, request
 from services.analyzer_service import AnalyzerService
+from services.inventory_service import InventoryService
+from services.api_usage import total_usage
+from services.job_manager import JobManager
 import config
 
 app = Flask(__name__)
 
 # Initialize services
-emr_service = EMRService()
 analyzer_service = AnalyzerService()
+inventory_service = InventoryService()
+job_manager = JobManager()
+
+
+@app.before_request
+def start_inventory_poller():
+    """Keep the cluster inventory warm in the background (started once, by the serving process)"""
+    if config.INVENTORY_POLL_INTERVAL_SECONDS > 0:
+        inventory_service.start_poller(config.INVENTORY_POLL_INTERVAL_SECONDS)
+
+
+def conditional_json(payload, headers: dict = None):
+    """
+    JSON response with a strong ETag over its body.
+    Requests whose If-None-Match matches get an empty 304 instead.
+    """
+    response = jsonify(payload)
+    response.set_etag(hashlib.sha256(response.get_data()).hexdigest())
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers.update(headers or {})
+    return response.make_conditional(request)
+
+
+def parse_lookback_hours(value) -> int:
+    """
+    Validate a requested lookback against config.LOOKBACK_OPTIONS (default when missing).
+    Raises ValueError for anything else.
+    """
+    if value is None or value == '':
+        return config.DEFAULT_LOOKBACK_HOURS
+
+    allowed_hours = sorted(option['hours'] for option in config.LOOKBACK_OPTIONS)
+    if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).strip().isdigit():
+        raise ValueError(f'lookback_hours must be one of {allowed_hours}')
+    if int(value) not in allowed_hours:
+        raise ValueError(f'lookback_hours must be one of {allowed_hours}')
+    return int(value)
 
 
 @app.route('/')
@@ -42,20 +82,28 @@ def get_clusters():
     """
     Get all EMR clusters including running and recently terminated.
     Returns clusters segregated by type (TRANSIENT, LONG_RUNNING) and state.
+    Served from the in-memory inventory snapshot, which is refreshed incrementally when stale.
+    The response has an ETag that only changes when the clusters do (304 on If-None-Match);
+    once the snapshot has synced, its sync time and age are returned in the X-Snapshot-Synced-At
+    and X-Snapshot-Age-Seconds headers.
 
     Query params:
         include_terminated: Include clusters terminated in last 3 hours (default: true)
+        refresh: Refresh the snapshot before responding (default: false)
     """
     try:
+        force_refresh = request.args.get('refresh', 'false').lower() == 'true'
+        inventory = inventory_service.get_clusters(force_refresh=force_refresh)
+
         # Get running clusters
-        running_clusters = emr_service.list_running_clusters()
+        running_clusters = inventory['running']
 
         # Check if we should include terminated clusters
         include_terminated = request.args.get('include_terminated', 'true').lower() == 'true'
 
         terminated_clusters = []
         if include_terminated:
-            terminated_clusters = emr_service.list_recently_terminated_clusters(hours=3)
+            terminated_clusters = inventory['terminated']
 
         # Segregate running clusters by type
         transient_clusters = [c for c in running_clusters if c['cluster_type'] == 'TRANSIENT']
@@ -71,7 +119,15 @@ def get_clusters():
         terminated_transient.sort(key=lambda x: x['runtime_hours'], reverse=True)
         terminated_long_running.sort(key=lambda x: x['runtime_hours'], reverse=True)
 
-        return jsonify({
+        # Snapshot headers are omitted until the first sync
+        snapshot_headers = {}
+        if inventory['synced_at']:
+            snapshot_headers = {
+                'X-Snapshot-Synced-At': inventory['synced_at'],
+                'X-Snapshot-Age-Seconds': str(inventory['age_seconds'])
+            }
+
+        return conditional_json({
             'success': True,
             'data': {
                 'transient': transient_clusters,
@@ -84,7 +140,7 @@ def get_clusters():
                 'long_running_count': len(long_running_clusters),
                 'terminated_count': len(terminated_clusters)
             }
-        })
+        }, snapshot_headers)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -94,16 +150,16 @@ def get_clusters():
 
 @app.route('/api/clusters/<cluster_id>', methods=['GET'])
 def get_cluster(cluster_id):
-    """Get details for a specific cluster"""
+    """Get details for a specific cluster (with ETag, 304 on If-None-Match)"""
     try:
-        cluster = emr_service.get_cluster_by_id(cluster_id)
+        cluster = inventory_service.get_cluster(cluster_id)
         if not cluster:
             return jsonify({
                 'success': False,
                 'error': f'Cluster {cluster_id} not found'
             }), 404
 
-        return jsonify({
+        return conditional_json({
             'success': True,
             'data': cluster
         })
@@ -117,33 +173,80 @@ def get_cluster(cluster_id):
 @app.route('/api/clusters/<cluster_id>/analyze', methods=['POST'])
 def analyze_cluster(cluster_id):
     """
-    Analyze a cluster's utilization and generate recommendations.
-    This endpoint triggers the full analysis pipeline.
+    Start an analysis of a cluster's utilization and recommendations as a background job.
+    Returns 202 with the job (poll GET /api/jobs/<job_id> for its status and result).
+    A request for a cluster and lookback that is already being analyzed joins that job; a forced
+    refresh only joins another forced refresh, never a job that may reuse a cached result.
 
     Query params:
-        lookback_hours: Number of hours to look back for metrics (default: from config)
+        lookback_hours: Number of hours to look back for metrics, one of config.LOOKBACK_OPTIONS (default: from config)
+        force_refresh: Recompute instead of reusing a result from the current metric period (default: false)
     """
     try:
-        # Get lookback hours from request (query param or JSON body)
+        # Get lookback hours from request (JSON body or query param)
         lookback_hours = None
+        force_refresh = request.args.get('force_refresh', 'false').lower() == 'true'
         if request.is_json and request.json:
             lookback_hours = request.json.get('lookback_hours')
-        if not lookback_hours:
-            lookback_hours = request.args.get('lookback_hours', type=int)
-        if not lookback_hours:
-            lookback_hours = config.DEFAULT_LOOKBACK_HOURS
+            force_refresh = force_refresh or bool(request.json.get('force_refresh'))
+        if lookback_hours is None:
+            lookback_hours = request.args.get('lookback_hours')
+        try:
+            lookback_hours = parse_lookback_hours(lookback_hours)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+
+        job, created = job_manager.submit(
+            ('analyze', cluster_id, lookback_hours, force_refresh),
+            run_cluster_analysis,
+            cluster_id,
+            lookback_hours,
+            force_refresh
+        )
+
+        response = jsonify({
+            'success': True,
+            'data': job,
+            'joined_existing_job': not created
+        })
+        response.status_code = 202
+        response.headers['Location'] = f"/api/jobs/{job['id']}"
+        return response
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-        analysis = analyzer_service.analyze_cluster(cluster_id, lookback_hours=lookback_hours)
 
-        if 'error' in analysis:
+def run_cluster_analysis(cluster_id: str, lookback_hours: int, force_refresh: bool = False) -> dict:
+    """Analysis job: read metrics in the cluster's own account/region"""
+    target = inventory_service.find_target(cluster_id)
+    return analyzer_service.analyze_cluster(
+        cluster_id, lookback_hours=lookback_hours, target=target, force_refresh=force_refresh
+    )
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Get a background job's status: queued, running, succeeded (with result) or failed (with error).
+    Finished jobs are kept for JOB_RESULT_TTL_SECONDS.
+    """
+    try:
+        job = job_manager.get(job_id)
+        if not job:
             return jsonify({
                 'success': False,
-                'error': analysis['error']
+                'error': f'Job {job_id} not found'
             }), 404
 
         return jsonify({
             'success': True,
-            'data': analysis
+            'data': job
         })
     except Exception as e:
         return jsonify({
@@ -194,6 +297,89 @@ def get_analysis_history():
         }), 500
 
 
+@app.route('/api/analysis/batch', methods=['POST'])
+def analyze_clusters_batch():
+    """
+    Analyze every cluster matching a filter, streaming results as NDJSON (one JSON object per line).
+    Lines are {"type": "start", "cluster_count"}, then {"type": "result", "cluster_id", "success",
+    "data" or "error"} as each analysis finishes, and finally {"type": "summary"} with fleet totals.
+
+    JSON body (all optional):
+        cluster_types: e.g. ["LONG_RUNNING"]
+        states: EMR states, e.g. ["RUNNING", "WAITING"]
+        tags: {"key": "value"} pairs that must all match
+        lookback_hours: Number of hours to look back for metrics, one of config.LOOKBACK_OPTIONS (default: from config)
+        force_refresh: Recompute instead of reusing results from the current metric period (default: false)
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        try:
+            lookback_hours = parse_lookback_hours(body.get('lookback_hours'))
+        except ValueError as e:
+            # Rejected before the stream starts, so the client gets a proper status code
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        force_refresh = bool(body.get('force_refresh'))
+        clusters = inventory_service.find_clusters(
+            cluster_types=body.get('cluster_types'),
+            states=body.get('states'),
+            tags=body.get('tags')
+        )
+        # Only (cluster id, target) pairs are kept; full cluster details are loaded per analysis
+        targets = [(cluster['id'], inventory_service.find_target(cluster['id'])) for cluster in clusters]
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+    def generate():
+        yield json.dumps({'type': 'start', 'cluster_count': len(targets)}) + '\n'
+
+        analyzed = failed = 0
+        hourly_savings = monthly_savings = 0.0
+        for result in analyzer_service.analyze_clusters(
+            targets, lookback_hours=lookback_hours, force_refresh=force_refresh
+        ):
+            if result['success']:
+                analyzed += 1
+                hourly_savings += result['data']['total_potential_hourly_savings']
+                monthly_savings += result['data']['total_potential_monthly_savings']
+            else:
+                failed += 1
+            yield json.dumps({'type': 'result', **result}, default=str) + '\n'
+
+        yield json.dumps({
+            'type': 'summary',
+            'analyzed_count': analyzed,
+            'failed_count': failed,
+            'total_potential_hourly_savings': round(hourly_savings, 4),
+            'total_potential_monthly_savings': round(monthly_savings, 2)
+        }) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Let reverse proxies pass lines through as they are written
+    })
+
+
+@app.route('/api/stats/aws-usage', methods=['GET'])
+def get_aws_usage():
+    """Get cumulative AWS API usage since the server started"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': total_usage.to_dict()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
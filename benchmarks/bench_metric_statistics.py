@@ -0,0 +1,128 @@
+"""
+Micro-benchmark for CloudWatchService datapoint statistics
+Compares _process_metric_datapoints with the original list-based implementation on 14-day
+(4,032-point, 5-minute) series and times _aggregate_values on a group of such series.
+
+Usage: python benchmarks/bench_metric_statistics.py [--series 200] [--instances 100]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config  # noqa: E402
+from services.cloudwatch_service import CloudWatchService  # noqa: E402
+
+
+SERIES_LENGTH = 14 * 24 * 3600 // config.CLOUDWATCH_PERIOD_SECONDS  # 4,032 datapoints
+
+
+def reference_process_metric_datapoints(service: CloudWatchService, datapoints, avg_stat: str) -> dict:
+    """The original implementation: Python lists, one np.percentile call per percentile, generator counts"""
+    averages = [dp[avg_stat] for dp in datapoints if avg_stat in dp]
+    maximums = [dp['Maximum'] for dp in datapoints if 'Maximum' in dp]
+    minimums = [dp['Minimum'] for dp in datapoints if 'Minimum' in dp]
+    if not averages:
+        return service._empty_metrics()
+
+    avg_value = np.mean(averages)
+    max_value = max(maximums) if maximums else max(averages)
+    min_value = min(minimums) if minimums else min(averages)
+    p75_value = np.percentile(averages, 75)
+    p90_value = np.percentile(averages, 90)
+    p95_value = np.percentile(averages, 95)
+    p99_value = np.percentile(averages, 99)
+
+    period_minutes = config.CLOUDWATCH_PERIOD_SECONDS / 60
+    duration_above = {}
+    for threshold in config.UTILIZATION_THRESHOLDS:
+        count_above = sum(1 for v in averages if v >= threshold)
+        duration_above[threshold] = round(count_above * period_minutes, 1)
+
+    spike_gap = p95_value - p90_value
+    is_spike = bool(spike_gap > config.SPIKE_DETECTION_GAP_PERCENT)
+    count_at_p95_level = sum(1 for v in averages if v >= p95_value * 0.95)
+    duration_at_p95_level = count_at_p95_level * period_minutes
+    effective_peak, peak_type, effective_peak_percentile = service._select_effective_peak(
+        p75_value, p90_value, p95_value, is_spike, duration_at_p95_level, duration_above
+    )
+
+    return {
+        'average': round(avg_value, 2),
+        'p75': round(p75_value, 2),
+        'p90': round(p90_value, 2),
+        'p95': round(p95_value, 2),
+        'p99': round(p99_value, 2),
+        'max': round(max_value, 2),
+        'min': round(min_value, 2),
+        'datapoints': len(averages),
+        'available': True,
+        'effective_peak': round(effective_peak, 2),
+        'effective_peak_percentile': effective_peak_percentile,
+        'peak_type': peak_type,
+        'is_spike': is_spike,
+        'spike_gap': round(spike_gap, 2),
+        'duration_above': duration_above,
+        'duration_at_p95_minutes': round(duration_at_p95_level, 1)
+    }
+
+
+def make_series(rng: random.Random, end_time: datetime) -> list:
+    """One 14-day series of CloudWatch-style datapoints with a few busy stretches"""
+    datapoints = []
+    for index in range(SERIES_LENGTH):
+        busy = (index // 288) % 3 == 0 and index % 288 < 40
+        average = rng.uniform(60, 98) if busy else rng.uniform(5, 70)
+        datapoints.append({
+            'Timestamp': end_time - timedelta(seconds=config.CLOUDWATCH_PERIOD_SECONDS * (SERIES_LENGTH - index)),
+            'Average': average,
+            'Maximum': min(100.0, average + rng.uniform(0, 5)),
+            'Minimum': max(0.0, average - rng.uniform(0, 5))
+        })
+    return datapoints
+
+
+def time_per_call(func, args_list) -> float:
+    """Average milliseconds per call over args_list"""
+    start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--series', type=int, default=200, help='Series timed per implementation')
+    parser.add_argument('--instances', type=int, default=100, help='Instances in the aggregated group')
+    args = parser.parse_args()
+
+    # Only the statistics methods are exercised, so no AWS clients or stores are needed
+    service = CloudWatchService.__new__(CloudWatchService)
+    rng = random.Random(42)
+    end_time = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    series = [make_series(rng, end_time) for _ in range(max(args.series, args.instances))]
+
+    for datapoints in series[:args.series]:
+        assert service._process_metric_datapoints(datapoints, 'Average') == \
+            reference_process_metric_datapoints(service, datapoints, 'Average'), 'outputs differ'
+
+    calls = [(datapoints, 'Average') for datapoints in series[:args.series]]
+    reference_ms = time_per_call(lambda dps, stat: reference_process_metric_datapoints(service, dps, stat), calls)
+    current_ms = time_per_call(service._process_metric_datapoints, calls)
+    print(f"_process_metric_datapoints, {SERIES_LENGTH}-point series ({args.series} series)")
+    print(f"  original: {reference_ms:.2f} ms per series")
+    print(f"  current:  {current_ms:.2f} ms per series ({reference_ms / current_ms:.1f}x)")
+
+    group = series[:args.instances]
+    aggregate_ms = time_per_call(service._aggregate_values, [(group,)] * 3)
+    print(f"_aggregate_values, {args.instances} x {SERIES_LENGTH} points: {aggregate_ms:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
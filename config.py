@@ -1,12 +1,68 @@
 """
 Configuration settings for EMR Cost Optimizer
 """
+import json
 import os
 
 # AWS Configuration
 AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
 AWS_PROFILE = os.environ.get('AWS_PROFILE', None)  # Uses default credentials chain if None
 
+# Discovery targets (accounts/regions), as a JSON list in AWS_TARGETS, e.g.
+# [{"name": "prod-us", "profile": "prod", "region": "us-east-1"},
+#  {"name": "analytics-eu", "role_arn": "arn:aws:iam::123456789012:role/EmrCostOptimizer", "region": "eu-west-1"}]
+# Defaults to a single target for AWS_PROFILE in AWS_REGION
+AWS_TARGETS = json.loads(os.environ['AWS_TARGETS']) if os.environ.get('AWS_TARGETS') else [
+    {'profile': AWS_PROFILE, 'region': AWS_REGION}
+]
+AWS_TARGET_TIMEOUT_SECONDS = int(os.environ.get('AWS_TARGET_TIMEOUT_SECONDS', 20))  # Slower targets serve their last snapshot
+AWS_ROLE_SESSION_NAME = 'emr-cost-optimizer'
+
+# AWS client settings (one shared client per service and target)
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 50))  # Per client; keep >= worker counts
+AWS_CONNECT_TIMEOUT_SECONDS = 5
+AWS_READ_TIMEOUT_SECONDS = 30
+
+# AWS API rate limiting: operation -> (requests per second, burst), shared per region/service/operation.
+# Sized below the default account quotas; raise them if your account has higher limits.
+AWS_API_RATE_LIMITS = {
+    'list_clusters': (5, 10),
+    'describe_cluster': (10, 20),
+    'list_instance_groups': (10, 20),
+    'list_instance_fleets': (10, 20),
+    'list_instances': (10, 20),
+    'describe_instances': (20, 50),
+    'get_metric_statistics': (200, 400),
+    'get_metric_data': (40, 50),
+}
+AWS_API_DEFAULT_RATE_LIMIT = (5, 10)
+# Retries are made by the rate-limited client (services/aws_client.py), not by botocore
+AWS_REQUEST_DEADLINE_SECONDS = 60  # Give up on a request (including waits and retries) after this long
+AWS_RETRY_MAX_ATTEMPTS = 8
+AWS_RETRY_BASE_DELAY_SECONDS = 0.2
+AWS_RETRY_MAX_DELAY_SECONDS = 10
+
+# CloudWatch API pricing (USD) used to estimate the API cost of each analysis
+CLOUDWATCH_PRICE_PER_1000_REQUESTS = 0.01  # GetMetricStatistics, ListMetrics
+CLOUDWATCH_PRICE_PER_1000_METRICS = 0.01  # GetMetricData, billed per metric requested
+
+# Cluster discovery concurrency
+EMR_MAX_WORKERS = int(os.environ.get('EMR_MAX_WORKERS', 8))  # Clusters hydrated in parallel
+
+# EC2 instance details (describe_instances)
+EC2_DESCRIBE_MAX_IDS_PER_REQUEST = 200  # describe_instances limit on values per filter
+EC2_DESCRIBE_PAGE_SIZE = 1000
+EC2_MAX_WORKERS = int(os.environ.get('EC2_MAX_WORKERS', 4))  # Chunks described in parallel
+EC2_DETAILS_CACHE_MAX_ENTRIES = 50000  # Least recently described instances are evicted first
+
+# Cluster inventory snapshot served by /api/clusters
+TERMINATED_CLUSTER_WINDOW_HOURS = 3  # Terminated clusters stay listed (and analyzable) this long
+# Longest plausible cluster runtime: terminated clusters created earlier than this are not listed
+MAX_CLUSTER_RUNTIME_DAYS = int(os.environ.get('MAX_CLUSTER_RUNTIME_DAYS', 90))
+INVENTORY_MAX_AGE_SECONDS = int(os.environ.get('INVENTORY_MAX_AGE_SECONDS', 60))  # Refresh older snapshots on request
+INVENTORY_POLL_INTERVAL_SECONDS = int(os.environ.get('INVENTORY_POLL_INTERVAL_SECONDS', 30))  # Background refresh, 0 disables
+INVENTORY_FULL_REFRESH_SECONDS = int(os.environ.get('INVENTORY_FULL_REFRESH_SECONDS', 900))  # Re-describe every cluster (catches resizes)
+
 # Cluster Classification
 # Transient cluster pattern: STRESS-XXXXXX-{S,L,XL}
 TRANSIENT_CLUSTER_PATTERN = r'^STRESS-\d+-(?:S|L|XL)$'
@@ -14,6 +70,28 @@ LONG_RUNNING_THRESHOLD_HOURS = 7  # Clusters running longer than this are consid
 
 # Metrics Configuration
 CLOUDWATCH_PERIOD_SECONDS = 300  # 5-minute resolution
+CLOUDWATCH_MAX_QUERIES_PER_REQUEST = 500  # GetMetricData limit on queries per request
+CLOUDWATCH_MAX_DATAPOINTS_PER_CALL = 1440  # GetMetricStatistics limit on datapoints per call
+
+# Resolution planning for long lookbacks
+# Windows longer than CLOUDWATCH_TARGET_DATAPOINTS periods use a coarser period, capped at
+# SUSTAINED_PEAK_THRESHOLD_MINUTES so sustained peaks remain detectable.
+# With the metric cache enabled, series are fetched and cached at CLOUDWATCH_PERIOD_SECONDS and
+# downsampled locally, so every lookback reuses the same cached series.
+CLOUDWATCH_PERIOD_CANDIDATES = [300, 600, 900, 1800, 3600]
+CLOUDWATCH_TARGET_DATAPOINTS = 1440
+
+# Metric collection concurrency
+# 'batch' packs many instances into GetMetricData requests,
+# 'concurrent' calls GetMetricStatistics per instance on a worker pool,
+# 'search' uses GetMetricData SEARCH expressions that each cover many instances of the cluster
+CLOUDWATCH_COLLECTION_MODE = os.environ.get('CLOUDWATCH_COLLECTION_MODE', 'batch')
+CLOUDWATCH_MAX_WORKERS = int(os.environ.get('CLOUDWATCH_MAX_WORKERS', 8))  # Worker pool size per collection
+CLOUDWATCH_SEARCH_EXPRESSION_MAX_LENGTH = 1024  # GetMetricData limit on expression length
+# Series whose (lifetime-clipped) windows round out to the same aligned window share GetMetricData requests.
+# Instances report nothing outside their lifetime, so widening a clipped window adds no datapoints.
+CLOUDWATCH_BATCH_WINDOW_ALIGNMENT_SECONDS = 6 * 3600
+CLOUDWATCH_MAX_IN_FLIGHT_REQUESTS = int(os.environ.get('CLOUDWATCH_MAX_IN_FLIGHT_REQUESTS', 16))  # Process-wide cap
 MAX_LOOKBACK_DAYS = 3  # Maximum lookback for long-running clusters
 TRANSIENT_LOOKBACK_HOURS = 4  # Lookback for transient clusters
 
@@ -30,6 +108,18 @@ LOOKBACK_OPTIONS = [
 ]
 DEFAULT_LOOKBACK_HOURS = 72  # Default to 3 days
 
+# Background analysis jobs (POST /api/clusters/<id>/analyze, GET /api/jobs/<id>)
+JOB_MAX_WORKERS = int(os.environ.get('JOB_MAX_WORKERS', 4))  # Analyses running at once
+JOB_RESULT_TTL_SECONDS = 600  # Finished jobs can be polled this long
+
+# Analysis result cache: results are reused while the analysis end time stays in the same
+# CLOUDWATCH_PERIOD_SECONDS bucket, so they are never older than one metric period
+ANALYSIS_CACHE_TTL_SECONDS = CLOUDWATCH_PERIOD_SECONDS
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', 256))  # 0 disables
+
+# Fleet-wide batch analysis (/api/analysis/batch)
+ANALYSIS_BATCH_MAX_WORKERS = int(os.environ.get('ANALYSIS_BATCH_MAX_WORKERS', 4))  # Clusters analyzed in parallel
+
 # CloudWatch Namespaces and Metrics
 EC2_NAMESPACE = 'AWS/EC2'
 CWAGENT_NAMESPACE = 'CWAgent'
@@ -63,4 +153,30 @@ HEADROOM_PERCENT = 20
 
 # Data persistence
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
-ANALYSIS_HISTORY_FILE = os.path.join(DATA_DIR, 'analysis_history.json')
+ANALYSIS_HISTORY_FILE = os.path.join(DATA_DIR, 'analysis_history.json')  # Legacy history, imported once
+
+# Analysis history (SQLite, WAL mode)
+ANALYSIS_HISTORY_DB = os.path.join(DATA_DIR, 'analysis_history.db')
+ANALYSIS_HISTORY_MAX_PER_CLUSTER = int(os.environ.get('ANALYSIS_HISTORY_MAX_PER_CLUSTER', 10))  # 0 keeps all
+ANALYSIS_HISTORY_MAX_AGE_DAYS = int(os.environ.get('ANALYSIS_HISTORY_MAX_AGE_DAYS', 90))  # 0 keeps all
+
+# SQLite stores (analysis history, metric rollups)
+SQLITE_BUSY_TIMEOUT_SECONDS = 10
+
+# Metric cache (datapoints persisted per instance/metric/period so re-analysis only fetches new data)
+METRIC_CACHE_ENABLED = os.environ.get('METRIC_CACHE_ENABLED', 'true').lower() == 'true'
+METRIC_CACHE_DIR = os.path.join(DATA_DIR, 'metric_cache')
+METRIC_CACHE_SETTLE_SECONDS = 900  # Recent buckets CloudWatch may still update are always refetched
+METRIC_CACHE_MAX_AGE_DAYS = 15  # Longest lookback option plus a day
+METRIC_CACHE_MAX_BYTES = 500 * 1024 * 1024
+METRIC_CACHE_EVICTION_INTERVAL_SECONDS = 600
+
+# Hourly metric rollups: mergeable summaries (count, sum, min, max, threshold counts, quantile sketch)
+# per instance/metric/hour. Group metrics merge stored hours and only fetch hours not yet rolled up.
+# Group percentiles are sketch estimates and group_mean_peak is not reported while rollups are on.
+METRIC_ROLLUPS_ENABLED = os.environ.get('METRIC_ROLLUPS_ENABLED', 'true').lower() == 'true'
+METRIC_ROLLUP_DB = os.path.join(DATA_DIR, 'metric_rollups.db')
+METRIC_ROLLUP_RELATIVE_ACCURACY = 0.01  # Percentiles are within 1% of the datapoint at their rank
+METRIC_ROLLUP_MAX_AGE_DAYS = 15  # Longest lookback option plus a day
+METRIC_ROLLUP_SLICE_SECONDS = 24 * 3600  # Windows are rolled up a day at a time to bound memory
+METRIC_ROLLUP_EVICTION_INTERVAL_SECONDS = 600
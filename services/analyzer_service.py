@@ -1,15 +1,20 @@
 """
 Analyzer Service for utilization analysis and recommendations
 """
-import json
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 from dateutil import parser as date_parser
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, Optional
 import config
 from services.emr_service import EMRService
 from services.cloudwatch_service import CloudWatchService
 from services.pricing_service import PricingService
+from services.history_store import HistoryStore
+from services.api_usage import track_usage
+from services.concurrency import imap_as_completed
 
 
 class AnalyzerService:
@@ -20,23 +25,170 @@ class AnalyzerService:
         self.cloudwatch_service = CloudWatchService()
         self.pricing_service = PricingService()
         self._ensure_data_dir()
+        self.history_store = HistoryStore()
+
+        # EMR/CloudWatch services per target (account/region), sharing one metric cache and rollup store
+        self._target_services = {
+            self.emr_service.target['name']: (self.emr_service, self.cloudwatch_service)
+        }
+        self._target_services_lock = threading.Lock()
+
+        # Memoized results: (cluster_id, lookback_hours, end period bucket) -> (monotonic time, result)
+        self._result_cache: OrderedDict = OrderedDict()
+        self._result_cache_lock = threading.Lock()
+
+    def _get_services(self, target: Optional[Dict] = None) -> tuple:
+        """Get the (EMRService, CloudWatchService) for a target (defaults to the first configured target)"""
+        if target is None:
+            return self.emr_service, self.cloudwatch_service
+
+        with self._target_services_lock:
+            if target['name'] not in self._target_services:
+                self._target_services[target['name']] = (
+                    EMRService(target),
+                    CloudWatchService(
+                        target,
+                        metric_cache=self.cloudwatch_service.metric_cache,
+                        rollup_store=self.cloudwatch_service.rollup_store
+                    )
+                )
+            return self._target_services[target['name']]
 
     def _ensure_data_dir(self):
         """Ensure data directory exists"""
         os.makedirs(config.DATA_DIR, exist_ok=True)
 
-    def analyze_cluster(self, cluster_id: str, lookback_hours: int = None) -> Dict:
+    def analyze_cluster(
+        self,
+        cluster_id: str,
+        lookback_hours: int = None,
+        target: Dict = None,
+        force_refresh: bool = False
+    ) -> Dict:
         """
         Perform full analysis on a cluster.
         Returns detailed metrics, sizing status, and recommendations.
+        Results are reused while the analysis end time falls in the same CLOUDWATCH_PERIOD_SECONDS
+        bucket (and for at most ANALYSIS_CACHE_TTL_SECONDS); 'cache' in the result tells whether it
+        was reused and how old it is.
 
         Args:
             cluster_id: EMR cluster ID
             lookback_hours: Number of hours to look back for metrics.
-                           If None, uses default from config.
+                           If None, uses DEFAULT_LOOKBACK_HOURS from config.
+            target: Account/region the cluster belongs to (see config.AWS_TARGETS).
+                    If None, uses the first configured target.
+            force_refresh: Recompute even if a cached result is available.
         """
-        # Get cluster details
-        cluster = self.emr_service.get_cluster_by_id(cluster_id)
+        # Resolve the default first, so that None and the default share cached results
+        lookback_hours = lookback_hours or config.DEFAULT_LOOKBACK_HOURS
+
+        # No new metric period has closed within the same end bucket, so the result cannot change
+        cache_key = (cluster_id, lookback_hours, int(time.time()) // config.CLOUDWATCH_PERIOD_SECONDS)
+        if not force_refresh:
+            cached = self._get_cached_result(cache_key)
+            if cached:
+                return cached
+
+        result = self._analyze_cluster(cluster_id, lookback_hours, target)
+        if 'error' in result:
+            return result
+
+        self._cache_result(cache_key, result)
+        return {**result, 'cache': {'hit': False, 'age_seconds': 0}}
+
+    def _get_cached_result(self, cache_key: tuple) -> Optional[Dict]:
+        """Get a memoized result younger than ANALYSIS_CACHE_TTL_SECONDS, or None"""
+        if config.ANALYSIS_CACHE_MAX_ENTRIES <= 0:
+            return None
+
+        with self._result_cache_lock:
+            entry = self._result_cache.get(cache_key)
+            if entry is None:
+                return None
+            cached_at, result = entry
+            age = time.monotonic() - cached_at
+            if age > config.ANALYSIS_CACHE_TTL_SECONDS:
+                del self._result_cache[cache_key]
+                return None
+            self._result_cache.move_to_end(cache_key)
+
+        return {**result, 'cache': {'hit': True, 'age_seconds': round(age, 1)}}
+
+    def _cache_result(self, cache_key: tuple, result: Dict):
+        """Memoize a result, evicting the least recently used beyond ANALYSIS_CACHE_MAX_ENTRIES"""
+        if config.ANALYSIS_CACHE_MAX_ENTRIES <= 0:
+            return
+
+        with self._result_cache_lock:
+            self._result_cache[cache_key] = (time.monotonic(), result)
+            self._result_cache.move_to_end(cache_key)
+            while len(self._result_cache) > config.ANALYSIS_CACHE_MAX_ENTRIES:
+                self._result_cache.popitem(last=False)
+
+    def _analyze_cluster(self, cluster_id: str, lookback_hours: int = None, target: Dict = None) -> Dict:
+        """Run and persist an analysis, with diagnostics of its AWS API usage"""
+        started = time.monotonic()
+        with track_usage() as usage:
+            result = self._run_analysis(cluster_id, lookback_hours, target)
+
+        if 'error' in result:
+            return result
+
+        # AWS API calls, datapoints, bytes and estimated CloudWatch cost of this analysis
+        result['diagnostics'] = {
+            'duration_seconds': round(time.monotonic() - started, 2),
+            'aws_api': usage.to_dict()
+        }
+
+        # Persist analysis
+        self._save_analysis(result)
+
+        return result
+
+    def analyze_clusters(
+        self,
+        clusters: Iterable[tuple],
+        lookback_hours: int = None,
+        max_workers: int = None,
+        force_refresh: bool = False
+    ) -> Iterator[Dict]:
+        """
+        Analyze many clusters on a worker pool, yielding each result as soon as it is done.
+        clusters is an iterable of (cluster_id, target) pairs; it is consumed lazily and results
+        are not kept, so memory does not grow with the number of clusters. Analyses of the same
+        target share its AWS clients and metric cache.
+        Yields {'cluster_id', 'success', 'data' or 'error'} in completion order.
+        """
+        def analyze(cluster: tuple) -> Dict:
+            cluster_id, target = cluster
+            try:
+                return self.analyze_cluster(
+                    cluster_id, lookback_hours=lookback_hours, target=target, force_refresh=force_refresh
+                )
+            except Exception as e:
+                print(f"Error analyzing cluster {cluster_id}: {e}")
+                return {'error': str(e)}
+
+        for (cluster_id, _), analysis in imap_as_completed(
+            analyze, clusters, max_workers or config.ANALYSIS_BATCH_MAX_WORKERS
+        ):
+            if 'error' in analysis:
+                yield {'cluster_id': cluster_id, 'success': False, 'error': analysis['error']}
+            else:
+                yield {'cluster_id': cluster_id, 'success': True, 'data': analysis}
+
+    def _run_analysis(self, cluster_id: str, lookback_hours: int = None, target: Dict = None) -> Dict:
+        """Collect metrics and build the analysis result for a cluster"""
+        emr_service, cloudwatch_service = self._get_services(target)
+
+        # Get cluster details, with the instances that terminated within the longest possible lookback
+        # (e.g. scaled-in task nodes of a running cluster); their metrics are clipped to termination
+        max_lookback_hours = lookback_hours or max(config.MAX_LOOKBACK_DAYS * 24, config.TRANSIENT_LOOKBACK_HOURS)
+        cluster = emr_service.get_cluster_by_id(
+            cluster_id,
+            terminated_after=datetime.now(timezone.utc) - timedelta(hours=max_lookback_hours)
+        )
         if not cluster:
             return {'error': f'Cluster {cluster_id} not found'}
 
@@ -53,7 +205,7 @@ class AnalyzerService:
             start_time = max(created_time, max_lookback)
         else:
             # Use the automatic calculation based on cluster type
-            start_time = self.cloudwatch_service.calculate_lookback_time(
+            start_time = cloudwatch_service.calculate_lookback_time(
                 cluster['cluster_type'],
                 created_time
             )
@@ -62,6 +214,9 @@ class AnalyzerService:
         now = datetime.now(timezone.utc)
         actual_lookback_hours = round((now - start_time).total_seconds() / 3600, 1)
 
+        # Pick one metric period for the whole analysis (coarser for long lookbacks)
+        period = cloudwatch_service.plan_period(start_time, now)
+
         # Analyze each instance group (CORE and TASK only, skip MASTER)
         node_analyses = {}
         total_potential_savings = 0
@@ -71,7 +226,10 @@ class AnalyzerService:
                 analysis = self._analyze_instance_group(
                     group,
                     start_time,
-                    cluster['cluster_type']
+                    cluster['cluster_type'],
+                    period,
+                    cloudwatch_service,
+                    emr_service
                 )
                 node_analyses[group['type']] = analysis
 
@@ -85,6 +243,8 @@ class AnalyzerService:
             'cluster_name': cluster['name'],
             'cluster_type': cluster['cluster_type'],
             'runtime_hours': cluster['runtime_hours'],
+            'region': cluster['region'],
+            'account_id': cluster['account_id'],
             'analyzed_at': datetime.now(timezone.utc).isoformat(),
             'lookback_hours': actual_lookback_hours,
             'requested_lookback_hours': lookback_hours or config.DEFAULT_LOOKBACK_HOURS,
@@ -92,23 +252,26 @@ class AnalyzerService:
                 'start': start_time.isoformat(),
                 'end': datetime.now(timezone.utc).isoformat()
             },
+            'metric_period_seconds': period,
             'node_analyses': node_analyses,
             'total_potential_hourly_savings': round(total_potential_savings, 4),
             'total_potential_monthly_savings': round(total_potential_savings * 730, 2)
         }
 
-        # Persist analysis
-        self._save_analysis(result)
-
         return result
 
     def _analyze_instance_group(
         self,
         group: Dict,
         start_time: datetime,
-        cluster_type: str
+        cluster_type: str,
+        period: int = None,
+        cloudwatch_service: CloudWatchService = None,
+        emr_service: EMRService = None
     ) -> Dict:
-        """Analyze a single instance group"""
+        """Analyze a single instance group (metrics read through cloudwatch_service, default target if None)"""
+        cloudwatch_service = cloudwatch_service or self.cloudwatch_service
+        emr_service = emr_service or self.emr_service
         instance_type = group['instance_type']
         ec2_instances = group.get('ec2_instances', [])
 
@@ -121,17 +284,20 @@ class AnalyzerService:
         # Get instance specifications
         instance_specs = self.pricing_service.get_instance_specs(instance_type)
 
-        # Get metrics
-        metrics = self.cloudwatch_service.get_aggregated_metrics_for_instances(
+        # Get metrics, querying each instance only for the time it was running
+        metrics = cloudwatch_service.get_aggregated_metrics_for_instances(
             ec2_instances,
-            start_time
+            start_time,
+            period=period,
+            instance_windows=self._get_instance_windows(group, emr_service)
         )
 
         # Determine if metrics are available
         metrics_available = metrics['instances_with_metrics'] > 0
+        instances_in_window = metrics.get('instances_in_window', metrics['instance_count'])
         partial_metrics = (
             metrics['instances_with_metrics'] > 0 and
-            metrics['instances_with_metrics'] < metrics['instance_count']
+            metrics['instances_with_metrics'] < instances_in_window
         )
 
         # Build metrics warning for task nodes in long-running clusters
@@ -144,7 +310,7 @@ class AnalyzerService:
                 )
             elif partial_metrics:
                 metrics_warning = (
-                    f"Partial metrics available ({metrics['instances_with_metrics']}/{metrics['instance_count']} instances). "
+                    f"Partial metrics available ({metrics['instances_with_metrics']}/{instances_in_window} instances). "
                     "Some task nodes may have scaled recently."
                 )
 
@@ -188,7 +354,8 @@ class AnalyzerService:
                 'cpu': metrics['cpu'],
                 'memory': metrics['memory'],
                 'instances_analyzed': metrics['instances_with_metrics'],
-                'total_instances': metrics['instance_count']
+                'total_instances': metrics['instance_count'],
+                'period_seconds': metrics['period_seconds']
             },
             'metrics_available': metrics_available,
             'partial_metrics': partial_metrics,
@@ -281,6 +448,28 @@ class AnalyzerService:
                 'downsizing_levels': -1
             }
 
+    def _get_instance_windows(self, group: Dict, emr_service: EMRService) -> Dict[str, tuple]:
+        """
+        Get instance_id -> (launched_at, terminated_at) for the group's instances from the EMR
+        instance timelines. Launch times missing from EMR are looked up with describe_instances.
+        """
+        windows = {}
+        for instance in group.get('instances', []):
+            windows[instance['ec2_instance_id']] = (
+                date_parser.parse(instance['launched_at']) if instance.get('launched_at') else None,
+                date_parser.parse(instance['terminated_at']) if instance.get('terminated_at') else None
+            )
+
+        missing_launch = [
+            instance_id for instance_id in group.get('ec2_instances', [])
+            if windows.get(instance_id, (None, None))[0] is None
+        ]
+        for details in emr_service.get_instance_group_ec2_details(missing_launch):
+            terminated_at = windows.get(details['instance_id'], (None, None))[1]
+            windows[details['instance_id']] = (date_parser.parse(details['launch_time']), terminated_at)
+
+        return windows
+
     def _calculate_confidence(self, metrics: Dict, cluster_type: str) -> Dict:
         """Calculate confidence score for the recommendation"""
         # Factors:
@@ -290,18 +479,32 @@ class AnalyzerService:
 
         cpu_datapoints = metrics['cpu'].get('datapoints', 0)
         mem_datapoints = metrics['memory'].get('datapoints', 0)
+        # Instances that were not running during the window are not expected to report metrics
+        instances_in_window = metrics.get('instances_in_window', metrics['instance_count'])
         instance_coverage = (
-            metrics['instances_with_metrics'] / metrics['instance_count']
-            if metrics['instance_count'] > 0 else 0
+            min(metrics['instances_with_metrics'] / instances_in_window, 1.0)
+            if instances_in_window > 0 else 0
         )
 
         # Calculate data score (based on datapoints)
-        total_datapoints = cpu_datapoints + mem_datapoints
+        # Group datapoints are pooled across instances, so score the per-instance average
+        total_datapoints = (cpu_datapoints + mem_datapoints) / max(metrics['instances_with_metrics'], 1)
         if cluster_type == 'TRANSIENT':
             expected_datapoints = 48 * 2  # ~4 hours of 5-min intervals, CPU + MEM
         else:
             expected_datapoints = 864 * 2  # ~3 days of 5-min intervals, CPU + MEM
 
+        # Instances only report while running, so expect at most their average lifetime in the window
+        if metrics.get('instance_hours') and instances_in_window > 0:
+            lifetime_datapoints = (
+                metrics['instance_hours'] / instances_in_window * 3600 / config.CLOUDWATCH_PERIOD_SECONDS * 2
+            )
+            expected_datapoints = min(expected_datapoints, lifetime_datapoints)
+
+        # Coarser periods produce proportionally fewer datapoints for the same window
+        period = metrics.get('period_seconds') or config.CLOUDWATCH_PERIOD_SECONDS
+        expected_datapoints *= config.CLOUDWATCH_PERIOD_SECONDS / period
+
         data_score = min(total_datapoints / expected_datapoints, 1.0) if expected_datapoints > 0 else 0
 
         # Calculate coverage score
@@ -321,7 +524,7 @@ class AnalyzerService:
         if data_score < 0.5:
             reasons.append('Limited metric data available')
         if coverage_score < 1.0:
-            reasons.append(f'Metrics from {metrics["instances_with_metrics"]}/{metrics["instance_count"]} instances')
+            reasons.append(f'Metrics from {metrics["instances_with_metrics"]}/{instances_in_window} instances')
 
         return {
             'level': level,
@@ -550,45 +753,24 @@ class AnalyzerService:
         return recommendations
 
     def _save_analysis(self, analysis: Dict):
-        """Save analysis to JSON file"""
+        """Save analysis to the history store (retention per ANALYSIS_HISTORY_* settings)"""
         try:
-            # Load existing data
-            history = self._load_analysis_history()
-
-            # Add new analysis (keyed by cluster_id)
-            cluster_id = analysis['cluster_id']
-            if cluster_id not in history:
-                history[cluster_id] = []
-
-            # Keep last 10 analyses per cluster
-            history[cluster_id].append(analysis)
-            history[cluster_id] = history[cluster_id][-10:]
-
-            # Save
-            with open(config.ANALYSIS_HISTORY_FILE, 'w') as f:
-                json.dump(history, f, indent=2, default=str)
+            self.history_store.save(analysis)
         except Exception as e:
             print(f"Error saving analysis: {e}")
 
-    def _load_analysis_history(self) -> Dict:
-        """Load analysis history from JSON file"""
+    def get_analysis_history(self, cluster_id: str = None) -> Dict:
+        """Get analysis history, optionally filtered by cluster_id"""
         try:
-            if os.path.exists(config.ANALYSIS_HISTORY_FILE):
-                with open(config.ANALYSIS_HISTORY_FILE, 'r') as f:
-                    return json.load(f)
+            return self.history_store.get_history(cluster_id)
         except Exception as e:
             print(f"Error loading analysis history: {e}")
-        return {}
-
-    def get_analysis_history(self, cluster_id: str = None) -> Dict:
-        """Get analysis history, optionally filtered by cluster_id"""
-        history = self._load_analysis_history()
-        if cluster_id:
-            return {cluster_id: history.get(cluster_id, [])}
-        return history
+            return {cluster_id: []} if cluster_id else {}
 
     def get_latest_analysis(self, cluster_id: str) -> Optional[Dict]:
         """Get the most recent analysis for a cluster"""
-        history = self._load_analysis_history()
-        cluster_history = history.get(cluster_id, [])
-        return cluster_history[-1] if cluster_history else None
+        try:
+            return self.history_store.get_latest(cluster_id)
+        except Exception as e:
+            print(f"Error loading analysis history: {e}")
+            return None
@@ -0,0 +1,128 @@
+"""
+AWS API usage accounting
+Counts calls, errors, datapoints and bytes per API operation, process-wide and per analysis
+"""
+import contextvars
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import config
+
+
+class ApiUsage:
+    """Thread-safe counters of AWS API usage, grouped by service and operation"""
+
+    COUNTERS = ('calls', 'errors', 'throttled', 'datapoints', 'metrics_requested', 'bytes')
+
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self._operations: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        service_name: str,
+        operation_name: str,
+        response: Optional[Dict] = None,
+        error: bool = False,
+        throttled: bool = False
+    ):
+        """Record one API attempt, with its response if it succeeded"""
+        key = f"{service_name}.{operation_name}"
+        datapoints, metrics_requested, size = self._measure(response) if response else (0, 0, 0)
+
+        with self._lock:
+            counts = self._operations.setdefault(key, dict.fromkeys(self.COUNTERS, 0))
+            counts['calls'] += 1
+            counts['errors'] += int(error)
+            counts['throttled'] += int(throttled)
+            counts['datapoints'] += datapoints
+            counts['metrics_requested'] += metrics_requested
+            counts['bytes'] += size
+
+    def to_dict(self) -> Dict:
+        """Get per-operation counts, totals and the estimated CloudWatch API cost"""
+        with self._lock:
+            operations = {key: dict(counts) for key, counts in sorted(self._operations.items())}
+
+        totals = dict.fromkeys(self.COUNTERS, 0)
+        for counts in operations.values():
+            for counter in self.COUNTERS:
+                totals[counter] += counts[counter]
+
+        return {
+            'since': self.started_at.isoformat(),
+            'operations': operations,
+            'totals': totals,
+            'estimated_cost_usd': round(self._estimate_cost(operations), 6)
+        }
+
+    @staticmethod
+    def _measure(response: Dict):
+        """Get (datapoints, metrics requested, bytes received) from an API response"""
+        headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+        try:
+            size = int(headers.get('content-length', 0))
+        except (TypeError, ValueError):
+            size = 0
+
+        if 'Datapoints' in response:
+            return len(response['Datapoints']), 0, size
+        if 'MetricDataResults' in response:
+            results = response['MetricDataResults']
+            return sum(len(r.get('Values', [])) for r in results), len(results), size
+        return 0, 0, size
+
+    @staticmethod
+    def _estimate_cost(operations: Dict[str, Dict[str, int]]) -> float:
+        """
+        Estimate CloudWatch API spend. GetMetricData is billed per metric requested,
+        the other CloudWatch read APIs per request. EMR and EC2 describe calls are free.
+        """
+        cost = 0.0
+        for key, counts in operations.items():
+            service_name, operation_name = key.split('.', 1)
+            if service_name != 'cloudwatch':
+                continue
+            billable_calls = counts['calls'] - counts['errors']
+            if operation_name == 'get_metric_data':
+                cost += counts['metrics_requested'] * config.CLOUDWATCH_PRICE_PER_1000_METRICS / 1000
+            else:
+                cost += billable_calls * config.CLOUDWATCH_PRICE_PER_1000_REQUESTS / 1000
+        return cost
+
+
+# Cumulative usage since the process started
+total_usage = ApiUsage()
+
+# Usage of the analysis running in the current context (see track_usage)
+_current_usage: contextvars.ContextVar = contextvars.ContextVar('aws_api_usage', default=None)
+
+
+@contextmanager
+def track_usage():
+    """
+    Count AWS API calls made inside the block (including on map_concurrently workers).
+    Yields the ApiUsage for the block.
+    """
+    usage = ApiUsage()
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+def record_call(
+    service_name: str,
+    operation_name: str,
+    response: Optional[Dict] = None,
+    error: bool = False,
+    throttled: bool = False
+):
+    """Record an API attempt in the cumulative counters and the current analysis, if any"""
+    total_usage.record(service_name, operation_name, response, error, throttled)
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.record(service_name, operation_name, response, error, throttled)
@@ -0,0 +1,301 @@
+"""
+Throttle-aware AWS client layer shared by EMRService and CloudWatchService
+Per-API token buckets, exponential backoff with full jitter, a per-request deadline,
+and a process-wide registry of sessions and clients
+"""
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import boto3
+import botocore.session
+from botocore.config import Config
+from botocore.credentials import CredentialProvider, CredentialResolver, DeferredRefreshableCredentials
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+import config
+from services.api_usage import record_call
+
+
+# Error codes AWS APIs return when a request is throttled
+THROTTLING_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+    'SlowDown',
+}
+
+# Pagination token used by each paginated operation (same name for input and output)
+PAGINATION_TOKENS = {
+    'list_clusters': 'Marker',
+    'list_instance_groups': 'Marker',
+    'list_instance_fleets': 'Marker',
+    'list_instances': 'Marker',
+    'describe_instances': 'NextToken',
+    'get_metric_data': 'NextToken',
+    'list_metrics': 'NextToken',
+}
+
+# Retries (AWS_RETRY_MAX_ATTEMPTS, with backoff) are handled by ThrottledClient,
+# so botocore makes a single attempt per call
+CLIENT_CONFIG = Config(
+    max_pool_connections=config.AWS_MAX_POOL_CONNECTIONS,
+    connect_timeout=config.AWS_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=config.AWS_READ_TIMEOUT_SECONDS,
+    retries={'mode': 'standard', 'total_max_attempts': 1}
+)
+
+
+class RequestDeadlineExceeded(Exception):
+    """Raised when an AWS request cannot complete within AWS_REQUEST_DEADLINE_SECONDS"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at a fixed rate"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline: float) -> bool:
+        """
+        Take one token, waiting for a refill if needed.
+        Returns False if no token becomes available before deadline (a time.monotonic() value).
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+# Buckets are shared by every client in the process, keyed by (credentials, region, service, operation)
+# since API quotas apply per account and region
+_token_buckets: Dict[Tuple, TokenBucket] = {}
+_token_buckets_lock = threading.Lock()
+
+
+def get_token_bucket(scope: Tuple, region: str, service_name: str, operation_name: str) -> TokenBucket:
+    """Get the shared token bucket for an API operation"""
+    key = (scope, region, service_name, operation_name)
+    with _token_buckets_lock:
+        if key not in _token_buckets:
+            rate, burst = config.AWS_API_RATE_LIMITS.get(operation_name, config.AWS_API_DEFAULT_RATE_LIMIT)
+            _token_buckets[key] = TokenBucket(rate, burst)
+        return _token_buckets[key]
+
+
+def create_client(session, service_name: str, scope: Tuple = ()) -> 'ThrottledClient':
+    """
+    Create a rate-limited client for an AWS service from a boto3 session.
+    scope identifies the credentials, so clients for different accounts get separate token buckets.
+    """
+    return ThrottledClient(session.client(service_name, config=CLIENT_CONFIG), scope)
+
+
+def get_targets() -> List[Dict]:
+    """
+    Get the configured discovery targets (config.AWS_TARGETS) with defaults filled in.
+    Each target is a dict with name, region, profile and role_arn.
+    """
+    targets = []
+    for target in config.AWS_TARGETS:
+        region = target.get('region') or config.AWS_REGION
+        profile = target.get('profile')
+        role_arn = target.get('role_arn')
+        targets.append({
+            'name': target.get('name') or f"{role_arn or profile or 'default'}/{region}",
+            'region': region,
+            'profile': profile,
+            'role_arn': role_arn
+        })
+    return targets
+
+
+# Sessions and clients are shared by every service in the process.
+# boto3 clients are thread-safe, but creating them from a shared session is not, hence the lock.
+_sessions: Dict[Tuple, boto3.Session] = {}
+_clients: Dict[Tuple, 'ThrottledClient'] = {}
+_registry_lock = threading.Lock()
+
+
+def get_client(service_name: str, target: Optional[Dict] = None) -> 'ThrottledClient':
+    """Get the shared rate-limited client for an AWS service and target (defaults to the first configured target)"""
+    session_key = _session_key(target)
+    key = (service_name,) + session_key
+    with _registry_lock:
+        if key not in _clients:
+            region_name, profile_name, role_arn = session_key
+            _clients[key] = create_client(_get_session(session_key), service_name, (profile_name, role_arn))
+        return _clients[key]
+
+
+def _session_key(target: Optional[Dict]) -> Tuple:
+    """(region, profile, role ARN) of a target"""
+    target = target or get_targets()[0]
+    return (target['region'], target.get('profile'), target.get('role_arn'))
+
+
+def _get_session(key: Tuple) -> boto3.Session:
+    """Get or create a session; the caller holds _registry_lock"""
+    if key not in _sessions:
+        region_name, profile_name, role_arn = key
+        session_kwargs = {'region_name': region_name}
+        if profile_name:
+            session_kwargs['profile_name'] = profile_name
+        session = boto3.Session(**session_kwargs)
+        if role_arn:
+            session = _assume_role_session(session, role_arn, region_name)
+        _sessions[key] = session
+    return _sessions[key]
+
+
+def _assume_role_session(base_session: boto3.Session, role_arn: str, region_name: str) -> boto3.Session:
+    """
+    Create a session with credentials from sts:AssumeRole on base_session.
+    The role is assumed on first use and again shortly before the credentials expire.
+    """
+    sts_client = base_session.client('sts')
+
+    def assume_role() -> Dict:
+        credentials = sts_client.assume_role(
+            RoleArn=role_arn,
+            RoleSessionName=config.AWS_ROLE_SESSION_NAME
+        )['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat()
+        }
+
+    # The session resolves credentials only through the assumed role
+    botocore_session = botocore.session.get_session()
+    botocore_session.register_component('credential_provider', CredentialResolver([
+        AssumeRoleCredentialProvider(assume_role)
+    ]))
+    return boto3.Session(botocore_session=botocore_session, region_name=region_name)
+
+
+class AssumeRoleCredentialProvider(CredentialProvider):
+    """Credential provider for sessions that use an assumed role (see _assume_role_session)"""
+
+    METHOD = 'sts-assume-role'
+
+    def __init__(self, assume_role):
+        super().__init__()
+        self._assume_role = assume_role
+
+    def load(self) -> DeferredRefreshableCredentials:
+        """Credentials that call assume_role on first use and refresh before they expire"""
+        return DeferredRefreshableCredentials(refresh_using=self._assume_role, method=self.METHOD)
+
+
+class ThrottledClient:
+    """
+    Wraps a boto3 client so every API call (including paginated calls) takes a token from
+    the operation's bucket and retries throttling and transient errors with jittered backoff.
+    Other attributes are passed through to the underlying client.
+    """
+
+    def __init__(self, client, scope: Tuple = ()):
+        self._client = client
+        self._scope = scope
+        self._service_name = client.meta.service_model.service_name
+        self._region = client.meta.region_name
+
+    def __getattr__(self, name):
+        if name in self._client.meta.method_to_api_mapping:
+            return lambda **kwargs: self._call(name, **kwargs)
+        return getattr(self._client, name)
+
+    def get_paginator(self, operation_name: str) -> 'ThrottledPaginator':
+        """Get a paginator whose page requests go through the rate limiter"""
+        return ThrottledPaginator(self, operation_name)
+
+    def _call(self, operation_name: str, **kwargs) -> Dict:
+        """Call an API operation with rate limiting, retries and a deadline"""
+        bucket = get_token_bucket(self._scope, self._region, self._service_name, operation_name)
+        deadline = time.monotonic() + config.AWS_REQUEST_DEADLINE_SECONDS
+        method = getattr(self._client, operation_name)
+
+        attempt = 0
+        while True:
+            if not bucket.acquire(deadline):
+                raise RequestDeadlineExceeded(
+                    f"{self._service_name}.{operation_name} rate limited past "
+                    f"{config.AWS_REQUEST_DEADLINE_SECONDS}s deadline"
+                )
+
+            try:
+                response = method(**kwargs)
+            except (ClientError, ConnectionError, HTTPClientError) as e:
+                record_call(self._service_name, operation_name, error=True, throttled=self._is_throttling(e))
+                attempt += 1
+                if not self._is_retryable(e) or attempt >= config.AWS_RETRY_MAX_ATTEMPTS:
+                    raise
+
+                # Exponential backoff with full jitter
+                delay = random.uniform(0, min(
+                    config.AWS_RETRY_MAX_DELAY_SECONDS,
+                    config.AWS_RETRY_BASE_DELAY_SECONDS * (2 ** attempt)
+                ))
+                if time.monotonic() + delay > deadline:
+                    raise
+                time.sleep(delay)
+                continue
+
+            record_call(self._service_name, operation_name, response)
+            return response
+
+    @staticmethod
+    def _is_throttling(error: Exception) -> bool:
+        """Check if an error is a throttling response"""
+        return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+    @classmethod
+    def _is_retryable(cls, error: Exception) -> bool:
+        """Throttling, 5xx and connection errors are retried"""
+        if isinstance(error, ClientError):
+            status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+            return cls._is_throttling(error) or status >= 500
+        return True
+
+
+class ThrottledPaginator:
+    """Paginator that requests each page through ThrottledClient"""
+
+    def __init__(self, client: ThrottledClient, operation_name: str):
+        self._client = client
+        self._operation_name = operation_name
+        self._token_name = PAGINATION_TOKENS[operation_name]
+
+    def paginate(self, **kwargs):
+        """Yield response pages until the service stops returning a pagination token"""
+        token = None
+        while True:
+            params = dict(kwargs)
+            if token:
+                params[self._token_name] = token
+
+            page = self._client._call(self._operation_name, **params)
+            yield page
+
+            token = page.get(self._token_name)
+            if not token:
+                break
@@ -1,33 +1,80 @@
 """
 CloudWatch Service for metrics collection
 """
-import boto3
+import threading
+import time
 import numpy as np
 from datetime import datetime, timezone, timedelta
 from typing import List, Dict, Optional
 import config
+from services.aws_client import get_client
+from services.concurrency import map_concurrently
+from services.metric_cache import MetricCache
+from services.metric_sketch import MetricSketch
+from services.rollup_store import RollupStore
+
+
+# Metric series collected per instance: key -> (namespace, metric name)
+METRIC_SOURCES = {
+    'cpu': (config.EC2_NAMESPACE, config.CPU_METRIC_NAME),
+    'memory': (config.CWAGENT_NAMESPACE, config.MEMORY_METRIC_NAME),
+}
+
+# Statistics requested per series: GetMetricData query id suffix -> statistic name
+METRIC_STATISTICS = {
+    'avg': 'Average',
+    'max': 'Maximum',
+    'min': 'Minimum',
+}
+
+# Caps CloudWatch requests in flight across all analyses in this process
+_in_flight_requests = threading.BoundedSemaphore(config.CLOUDWATCH_MAX_IN_FLIGHT_REQUESTS)
+
+# Per-query GetMetricData status codes that mean the query's results are incomplete
+FAILED_QUERY_STATUS_CODES = ('InternalError', 'Forbidden')
+
+# Default for the store arguments of CloudWatchService: build the store if enabled in config
+# (None means no store)
+_DEFAULT_STORE = object()
 
 
 class CloudWatchService:
     """Service for CloudWatch metrics collection"""
 
-    def __init__(self):
-        session_kwargs = {'region_name': config.AWS_REGION}
-        if config.AWS_PROFILE:
-            session_kwargs['profile_name'] = config.AWS_PROFILE
+    def __init__(
+        self,
+        target: Optional[Dict] = None,
+        metric_cache: Optional[MetricCache] = _DEFAULT_STORE,
+        rollup_store: Optional[RollupStore] = _DEFAULT_STORE
+    ):
+        """
+        metric_cache and rollup_store default to new stores when enabled in config;
+        pass shared stores to reuse them, or None to go without.
+        """
+        # Metrics are read in the account/region of the target (see config.AWS_TARGETS)
+        self.cloudwatch_client = get_client('cloudwatch', target)
 
-        self.session = boto3.Session(**session_kwargs)
-        self.cloudwatch_client = self.session.client('cloudwatch')
+        # Persistent datapoint cache so repeated analyses only fetch new time ranges
+        if metric_cache is _DEFAULT_STORE:
+            metric_cache = MetricCache() if config.METRIC_CACHE_ENABLED else None
+        self.metric_cache = metric_cache
+
+        # Hourly rollups so group metrics only fetch the hours that are not summarized yet
+        if rollup_store is _DEFAULT_STORE:
+            rollup_store = RollupStore() if config.METRIC_ROLLUPS_ENABLED else None
+        self.rollup_store = rollup_store
 
     def get_instance_metrics(
         self,
         instance_id: str,
         start_time: datetime,
-        end_time: datetime = None
+        end_time: datetime = None,
+        period: int = None
     ) -> Dict:
         """
         Get CPU and Memory metrics for an EC2 instance.
         Returns average, p95 (peak), min, max, and datapoint count.
+        If period is None, it is chosen by plan_period for the window.
         """
         if end_time is None:
             end_time = datetime.now(timezone.utc)
@@ -38,8 +85,11 @@ class CloudWatchService:
         if end_time.tzinfo is None:
             end_time = end_time.replace(tzinfo=timezone.utc)
 
-        cpu_metrics = self._get_cpu_metrics(instance_id, start_time, end_time)
-        memory_metrics = self._get_memory_metrics(instance_id, start_time, end_time)
+        if period is None:
+            period = self.plan_period(start_time, end_time)
+
+        cpu_metrics = self._get_cpu_metrics(instance_id, start_time, end_time, period)
+        memory_metrics = self._get_memory_metrics(instance_id, start_time, end_time, period)
 
         return {
             'instance_id': instance_id,
@@ -54,23 +104,13 @@ class CloudWatchService:
         self,
         instance_id: str,
         start_time: datetime,
-        end_time: datetime
+        end_time: datetime,
+        period: int
     ) -> Dict:
         """Get CPU utilization metrics from AWS/EC2 namespace"""
         try:
-            response = self.cloudwatch_client.get_metric_statistics(
-                Namespace=config.EC2_NAMESPACE,
-                MetricName=config.CPU_METRIC_NAME,
-                Dimensions=[
-                    {'Name': 'InstanceId', 'Value': instance_id}
-                ],
-                StartTime=start_time,
-                EndTime=end_time,
-                Period=config.CLOUDWATCH_PERIOD_SECONDS,
-                Statistics=['Average', 'Maximum', 'Minimum']
-            )
-
-            return self._process_metric_datapoints(response['Datapoints'], 'Average')
+            datapoints = self._get_series_datapoints(instance_id, 'cpu', start_time, end_time, period)
+            return self._process_metric_datapoints(datapoints, 'Average', period)
         except Exception as e:
             print(f"Error getting CPU metrics for {instance_id}: {e}")
             return self._empty_metrics()
@@ -79,58 +119,642 @@ class CloudWatchService:
         self,
         instance_id: str,
         start_time: datetime,
-        end_time: datetime
+        end_time: datetime,
+        period: int
     ) -> Dict:
         """Get Memory utilization metrics from CWAgent namespace"""
         try:
+            datapoints = self._get_series_datapoints(instance_id, 'memory', start_time, end_time, period)
+            return self._process_metric_datapoints(datapoints, 'Average', period)
+        except Exception as e:
+            print(f"Error getting Memory metrics for {instance_id}: {e}")
+            return self._empty_metrics()
+
+    def _get_series_datapoints(
+        self,
+        instance_id: str,
+        metric_key: str,
+        start_time: datetime,
+        end_time: datetime,
+        period: int
+    ) -> List[Dict]:
+        """
+        Get datapoints for one instance metric with GetMetricStatistics.
+        When the metric cache is enabled, only ranges missing from the cache are fetched; the cache
+        holds series at CLOUDWATCH_PERIOD_SECONDS and coarser periods are downsampled locally.
+        """
+        if not self.metric_cache:
+            return self._get_metric_statistics(instance_id, metric_key, start_time, end_time, period)
+
+        base_period = config.CLOUDWATCH_PERIOD_SECONDS
+        cache_key = self._cache_key(instance_id, metric_key, base_period)
+        for gap_start, gap_end in self.metric_cache.get_missing_ranges(cache_key, start_time, end_time):
+            datapoints = self._get_metric_statistics(instance_id, metric_key, gap_start, gap_end, base_period)
+            self.metric_cache.store(cache_key, gap_start, gap_end, datapoints)
+
+        return self._downsample(self.metric_cache.get_datapoints(cache_key, start_time, end_time), period)
+
+    def _get_metric_statistics(
+        self,
+        instance_id: str,
+        metric_key: str,
+        start_time: datetime,
+        end_time: datetime,
+        period: int
+    ) -> List[Dict]:
+        """
+        Fetch raw datapoints for one instance metric with GetMetricStatistics.
+        Windows longer than CLOUDWATCH_MAX_DATAPOINTS_PER_CALL periods are split into
+        sub-windows that are fetched concurrently and merged by timestamp.
+        """
+        windows = self._split_window(start_time, end_time, period)
+
+        if len(windows) == 1:
+            return self._get_metric_statistics_window(instance_id, metric_key, start_time, end_time, period)
+
+        window_datapoints = map_concurrently(
+            lambda window: self._get_metric_statistics_window(instance_id, metric_key, *window, period),
+            windows,
+            config.CLOUDWATCH_MAX_WORKERS
+        )
+
+        # Merge sub-windows, de-duplicating datapoints that share a timestamp
+        datapoints_by_time = {}
+        for datapoints in window_datapoints:
+            for dp in datapoints:
+                datapoints_by_time[dp['Timestamp']] = dp
+
+        return [datapoints_by_time[ts] for ts in sorted(datapoints_by_time)]
+
+    def _get_metric_statistics_window(
+        self,
+        instance_id: str,
+        metric_key: str,
+        start_time: datetime,
+        end_time: datetime,
+        period: int
+    ) -> List[Dict]:
+        """Run a single GetMetricStatistics call for one instance metric"""
+        namespace, metric_name = METRIC_SOURCES[metric_key]
+
+        with _in_flight_requests:
             response = self.cloudwatch_client.get_metric_statistics(
-                Namespace=config.CWAGENT_NAMESPACE,
-                MetricName=config.MEMORY_METRIC_NAME,
+                Namespace=namespace,
+                MetricName=metric_name,
                 Dimensions=[
                     {'Name': 'InstanceId', 'Value': instance_id}
                 ],
                 StartTime=start_time,
                 EndTime=end_time,
-                Period=config.CLOUDWATCH_PERIOD_SECONDS,
-                Statistics=['Average', 'Maximum', 'Minimum']
+                Period=period,
+                Statistics=list(METRIC_STATISTICS.values())
             )
 
-            return self._process_metric_datapoints(response['Datapoints'], 'Average')
-        except Exception as e:
-            print(f"Error getting Memory metrics for {instance_id}: {e}")
-            return self._empty_metrics()
+        return response['Datapoints']
+
+    def _split_window(self, start_time: datetime, end_time: datetime, period: int) -> List[tuple]:
+        """
+        Split [start_time, end_time) into sub-windows of at most CLOUDWATCH_MAX_DATAPOINTS_PER_CALL
+        periods each. Boundaries fall on period buckets so sub-windows never share a datapoint.
+        """
+        max_window = timedelta(seconds=period * config.CLOUDWATCH_MAX_DATAPOINTS_PER_CALL)
+        if end_time - start_time <= max_window:
+            return [(start_time, end_time)]
+
+        # Align the first boundary to the period grid
+        epoch = int(start_time.timestamp())
+        boundary = datetime.fromtimestamp(epoch - epoch % period, timezone.utc) + max_window
+
+        windows = []
+        window_start = start_time
+        while boundary < end_time:
+            windows.append((window_start, boundary))
+            window_start = boundary
+            boundary += max_window
+        windows.append((window_start, end_time))
+
+        return windows
+
+    def get_metrics_for_instances(
+        self,
+        instance_ids: List[str],
+        start_time: datetime,
+        end_time: datetime = None,
+        period: int = None
+    ) -> List[Dict]:
+        """
+        Get CPU and Memory metrics for many EC2 instances using batched GetMetricData calls.
+        Returns one entry per instance (same shape as get_instance_metrics), in input order.
+        If period is None, it is chosen by plan_period for the window.
+        """
+        if end_time is None:
+            end_time = datetime.now(timezone.utc)
+
+        # Ensure timezone awareness
+        if start_time.tzinfo is None:
+            start_time = start_time.replace(tzinfo=timezone.utc)
+        if end_time.tzinfo is None:
+            end_time = end_time.replace(tzinfo=timezone.utc)
+
+        if period is None:
+            period = self.plan_period(start_time, end_time)
+
+        datapoints = self._get_batched_series_datapoints(
+            self._series_keys(instance_ids), start_time, end_time, period
+        )
+
+        return [
+            self._build_instance_metrics(instance_id, datapoints, start_time, end_time, period)
+            for instance_id in instance_ids
+        ]
+
+    def _series_keys(self, instance_ids: List[str]) -> List[tuple]:
+        """Get the (instance_id, metric key) series to collect for a list of instances"""
+        return [
+            (instance_id, metric_key)
+            for instance_id in dict.fromkeys(instance_ids)
+            for metric_key in METRIC_SOURCES
+        ]
+
+    def _build_instance_metrics(
+        self,
+        instance_id: str,
+        datapoints: Dict[tuple, List[Dict]],
+        start_time: datetime,
+        end_time: datetime,
+        period: int
+    ) -> Dict:
+        """Build the per-instance metrics entry (same shape as get_instance_metrics) from raw series"""
+        cpu_metrics = self._process_metric_datapoints(datapoints.get((instance_id, 'cpu'), []), 'Average', period)
+        memory_metrics = self._process_metric_datapoints(datapoints.get((instance_id, 'memory'), []), 'Average', period)
+        return self._instance_metrics_entry(instance_id, cpu_metrics, memory_metrics, start_time, end_time)
+
+    def _instance_metrics_entry(
+        self,
+        instance_id: str,
+        cpu_metrics: Dict,
+        memory_metrics: Dict,
+        start_time: datetime,
+        end_time: datetime
+    ) -> Dict:
+        """Per-instance metrics entry (same shape as get_instance_metrics)"""
+        return {
+            'instance_id': instance_id,
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat(),
+            'cpu': cpu_metrics,
+            'memory': memory_metrics,
+            'metrics_available': cpu_metrics['datapoints'] > 0 or memory_metrics['datapoints'] > 0
+        }
+
+    def _collect_instance_series(
+        self,
+        instance_ids: List[str],
+        start_time: datetime,
+        end_time: datetime,
+        period: int,
+        series_windows: Optional[Dict[str, Optional[tuple]]] = None
+    ) -> Dict[tuple, List[Dict]]:
+        """
+        Get raw datapoints for every (instance_id, metric key) series using the configured collection mode.
+        series_windows optionally maps instance_id -> (start, end) query window, or None to skip the
+        instance (see _clip_instance_windows). Series that fail to load are returned as empty lists.
+        """
+        series_keys = self._series_keys(instance_ids)
+        requests = self._series_requests(series_keys, start_time, end_time, series_windows)
+        fetched = self._get_range_datapoints(requests, period)
+        datapoints = {series: series_datapoints for (series, _, _), series_datapoints in zip(requests, fetched)}
+        return {series: datapoints.get(series) or [] for series in series_keys}
+
+    def _get_batched_series_datapoints(
+        self,
+        series_keys: List[tuple],
+        start_time: datetime,
+        end_time: datetime,
+        period: int,
+        series_windows: Optional[Dict[str, Optional[tuple]]] = None
+    ) -> Dict[tuple, List[Dict]]:
+        """
+        Get datapoints for many (instance_id, metric key) series with GetMetricData (see
+        _get_batched_range_datapoints). Each series is queried over its own window from
+        series_windows, if given. Series that fail to load are returned as empty lists.
+        """
+        requests = self._series_requests(series_keys, start_time, end_time, series_windows)
+        fetched = self._get_batched_range_datapoints(requests, period)
+        datapoints = {series: series_datapoints for (series, _, _), series_datapoints in zip(requests, fetched)}
+        return {series: datapoints.get(series) or [] for series in series_keys}
+
+    def _series_requests(
+        self,
+        series_keys: List[tuple],
+        start_time: datetime,
+        end_time: datetime,
+        series_windows: Optional[Dict[str, Optional[tuple]]] = None
+    ) -> List[tuple]:
+        """Get a (series, start, end) request per series, leaving out series whose instance has no window"""
+        if series_windows is None:
+            return [(series, start_time, end_time) for series in series_keys]
+        return [(series, *series_windows[series[0]]) for series in series_keys if series_windows[series[0]]]
+
+    def _get_range_datapoints(self, requests: List[tuple], period: int) -> List[Optional[List[Dict]]]:
+        """
+        Get datapoints for (series, start_time, end_time) requests using the configured collection mode
+        and the metric cache. Same return value as _fetch_metric_data.
+        """
+        if config.CLOUDWATCH_COLLECTION_MODE != 'concurrent':
+            return self._get_batched_range_datapoints(requests, period)
+
+        def fetch_request(request: tuple) -> Optional[List[Dict]]:
+            (instance_id, metric_key), start_time, end_time = request
+            try:
+                return self._get_series_datapoints(instance_id, metric_key, start_time, end_time, period)
+            except Exception as e:
+                print(f"Error getting {metric_key} metrics for {instance_id}: {e}")
+                return None
+
+        return map_concurrently(fetch_request, requests, config.CLOUDWATCH_MAX_WORKERS)
+
+    def _get_batched_range_datapoints(self, requests: List[tuple], period: int) -> List[Optional[List[Dict]]]:
+        """
+        Get datapoints for (series, start_time, end_time) requests with GetMetricData: one query per
+        series or, in 'search' mode, SEARCH expressions covering many instances.
+        When the metric cache is enabled, only ranges missing from the cache are fetched; the cache
+        holds series at CLOUDWATCH_PERIOD_SECONDS and coarser periods are downsampled locally.
+        Same return value as _fetch_metric_data.
+        """
+        if config.CLOUDWATCH_COLLECTION_MODE == 'search':
+            fetch_metric_data = self._search_metric_data
+        else:
+            fetch_metric_data = self._fetch_metric_data
+
+        if not self.metric_cache:
+            return fetch_metric_data(requests, period)
+
+        base_period = config.CLOUDWATCH_PERIOD_SECONDS
+        gaps = []  # (request index, (series, gap start, gap end))
+        for request_index, (series, start_time, end_time) in enumerate(requests):
+            cache_key = self._cache_key(*series, base_period)
+            for gap_start, gap_end in self.metric_cache.get_missing_ranges(cache_key, start_time, end_time):
+                gaps.append((request_index, (series, gap_start, gap_end)))
+
+        fetched = fetch_metric_data([gap for _, gap in gaps], base_period)
+
+        failed = set()
+        for (request_index, (series, gap_start, gap_end)), datapoints in zip(gaps, fetched):
+            # Failed fetches are not stored so the range is retried next time
+            if datapoints is None:
+                failed.add(request_index)
+            else:
+                self.metric_cache.store(self._cache_key(*series, base_period), gap_start, gap_end, datapoints)
+
+        return [
+            None if request_index in failed else self._downsample(
+                self.metric_cache.get_datapoints(self._cache_key(*series, base_period), start_time, end_time), period
+            )
+            for request_index, (series, start_time, end_time) in enumerate(requests)
+        ]
+
+    def _group_requests_by_window(self, requests: List[tuple]) -> Dict[tuple, List[int]]:
+        """
+        Group (series, start_time, end_time) requests whose ranges round out to the same
+        CLOUDWATCH_BATCH_WINDOW_ALIGNMENT_SECONDS-aligned window, so series clipped to slightly
+        different instance lifetimes still share GetMetricData requests.
+        Returns {(fetch start, fetch end): [request index]}; the fetch range covers every request in its group.
+        """
+        alignment = config.CLOUDWATCH_BATCH_WINDOW_ALIGNMENT_SECONDS
+        groups = {}
+        for request_index, (_, start_time, end_time) in enumerate(requests):
+            window = (start_time.timestamp() // alignment, -(-end_time.timestamp() // alignment))
+            groups.setdefault(window, []).append(request_index)
+
+        return {
+            (
+                min(requests[request_index][1] for request_index in request_indexes),
+                max(requests[request_index][2] for request_index in request_indexes)
+            ): request_indexes
+            for request_indexes in groups.values()
+        }
+
+    def _window_datapoints(
+        self,
+        datapoints_by_time: Dict[datetime, Dict],
+        start_time: datetime,
+        end_time: datetime,
+        period: int
+    ) -> List[Dict]:
+        """
+        Convert a {timestamp: datapoint} map into a datapoint list, keeping only the period buckets
+        of [start_time, end_time) (a batch may have been fetched over a wider range)
+        """
+        epoch = int(start_time.timestamp())
+        first_bucket = datetime.fromtimestamp(epoch - epoch % period, timezone.utc)
+        return [datapoints_by_time[ts] for ts in sorted(datapoints_by_time) if first_bucket <= ts < end_time]
+
+    def _downsample(self, datapoints: List[Dict], period: int) -> List[Dict]:
+        """
+        Combine CLOUDWATCH_PERIOD_SECONDS datapoints into period buckets (aligned to the epoch):
+        mean of the averages, max of the maximums and min of the minimums. Matches what CloudWatch
+        returns for the coarser period when every datapoint holds the same number of samples.
+        """
+        if period == config.CLOUDWATCH_PERIOD_SECONDS:
+            return datapoints
+
+        buckets = {}
+        for dp in datapoints:
+            epoch = int(dp['Timestamp'].timestamp())
+            buckets.setdefault(epoch - epoch % period, []).append(dp)
+
+        downsampled = []
+        for bucket in sorted(buckets):
+            datapoint = {'Timestamp': datetime.fromtimestamp(bucket, timezone.utc)}
+            for statistic, combine in (('Average', np.mean), ('Maximum', max), ('Minimum', min)):
+                values = [dp[statistic] for dp in buckets[bucket] if statistic in dp]
+                if values:
+                    datapoint[statistic] = float(combine(values))
+            downsampled.append(datapoint)
+
+        return downsampled
+
+    def _fetch_metric_data(self, requests: List[tuple], period: int) -> List[Optional[List[Dict]]]:
+        """
+        Fetch raw datapoints for (series, start_time, end_time) requests, packing as many
+        queries per GetMetricData request as allowed. Requests in the same aligned time window
+        (see _group_requests_by_window) are batched together.
+        Returns one datapoint list per request (same keys as get_metric_statistics datapoints),
+        or None where the request failed.
+        """
+        series_per_batch = max(1, config.CLOUDWATCH_MAX_QUERIES_PER_REQUEST // len(METRIC_STATISTICS))
+
+        batches = []
+        for (start_time, end_time), request_indexes in self._group_requests_by_window(requests).items():
+            indexed_series = [(request_index, requests[request_index][0]) for request_index in request_indexes]
+            for offset in range(0, len(indexed_series), series_per_batch):
+                queries, query_index = self._build_metric_data_queries(
+                    indexed_series[offset:offset + series_per_batch], period
+                )
+                batches.append((queries, query_index, start_time, end_time))
+
+        def fetch_batch(batch: tuple) -> Optional[tuple]:
+            queries, _, start_time, end_time = batch
+            try:
+                return self._get_metric_data(queries, start_time, end_time)
+            except Exception as e:
+                print(f"Error getting metric data for batch of {len(queries)} queries: {e}")
+                return None
+
+        batch_results = map_concurrently(fetch_batch, batches, config.CLOUDWATCH_MAX_WORKERS)
+
+        series_datapoints = [{} for _ in requests]
+        for (_, query_index, _, _), batch_result in zip(batches, batch_results):
+            results, failed_query_ids = batch_result or ({}, set(query_index))
+            for query_id, (request_index, statistic) in query_index.items():
+                # A failed query fails its whole series (a series is not partially cached or rolled up)
+                if query_id in failed_query_ids:
+                    series_datapoints[request_index] = None
+                datapoints_by_time = series_datapoints[request_index]
+                if datapoints_by_time is None:
+                    continue
+                for timestamp, value in results.get(query_id, {}).items():
+                    datapoints_by_time.setdefault(timestamp, {'Timestamp': timestamp})[statistic] = value
+
+        # Convert {timestamp: datapoint} maps into datapoint lists over each request's own range
+        return [
+            self._window_datapoints(by_time, start_time, end_time, period) if by_time is not None else None
+            for by_time, (_, start_time, end_time) in zip(series_datapoints, requests)
+        ]
+
+    def _build_metric_data_queries(self, indexed_series: List[tuple], period: int) -> tuple:
+        """
+        Build GetMetricData queries for (request index, (instance_id, metric key)) pairs.
+        Returns tuple of (list of queries, dict of query id -> (request index, statistic))
+        """
+        queries = []
+        query_index = {}
+
+        for request_index, (instance_id, metric_key) in indexed_series:
+            namespace, metric_name = METRIC_SOURCES[metric_key]
+            for stat_id, statistic in METRIC_STATISTICS.items():
+                # Query ids must start with a lowercase letter and be unique per request
+                query_id = f"r{request_index}_{stat_id}"
+                queries.append({
+                    'Id': query_id,
+                    'MetricStat': {
+                        'Metric': {
+                            'Namespace': namespace,
+                            'MetricName': metric_name,
+                            'Dimensions': [
+                                {'Name': 'InstanceId', 'Value': instance_id}
+                            ]
+                        },
+                        'Period': period,
+                        'Stat': statistic
+                    },
+                    'ReturnData': True
+                })
+                query_index[query_id] = (request_index, statistic)
+
+        return queries, query_index
+
+    def _search_metric_data(self, requests: List[tuple], period: int) -> List[Optional[List[Dict]]]:
+        """
+        Fetch raw datapoints for (series, start_time, end_time) requests with SEARCH expressions.
+        Each expression matches a metric for a list of instance IDs, so one query covers many
+        instances; results are labelled with their InstanceId and mapped back to the requests.
+        Same return value as _fetch_metric_data.
+        """
+        requests_by_metric = {}
+        for (start_time, end_time), request_indexes in self._group_requests_by_window(requests).items():
+            for request_index in request_indexes:
+                instance_id, metric_key = requests[request_index][0]
+                # A series can have several requests in one window (e.g. two cache gaps); each gets the series
+                requests_by_metric.setdefault((start_time, end_time, metric_key), {}).setdefault(
+                    instance_id, []
+                ).append(request_index)
+
+        # Every expression is a query per statistic: query id -> (instance_id -> request indexes, statistic)
+        queries_by_range = {}
+        for (start_time, end_time, metric_key), request_indexes in requests_by_metric.items():
+            range_queries = queries_by_range.setdefault((start_time, end_time), [])
+            for instance_ids in self._chunk_search_instances(metric_key, list(request_indexes), period):
+                chunk_indexes = {instance_id: request_indexes[instance_id] for instance_id in instance_ids}
+                for stat_id, statistic in METRIC_STATISTICS.items():
+                    range_queries.append((
+                        {
+                            # Query ids must start with a lowercase letter and be unique per request
+                            'Id': f"s{chunk_indexes[instance_ids[0]][0]}_{stat_id}",
+                            'Expression': self._build_search_expression(metric_key, instance_ids, statistic, period),
+                            'Label': "${PROP('Dim.InstanceId')}",
+                            'ReturnData': True
+                        },
+                        chunk_indexes,
+                        statistic
+                    ))
+
+        batches = []
+        for (start_time, end_time), range_queries in queries_by_range.items():
+            for offset in range(0, len(range_queries), config.CLOUDWATCH_MAX_QUERIES_PER_REQUEST):
+                batches.append((range_queries[offset:offset + config.CLOUDWATCH_MAX_QUERIES_PER_REQUEST], start_time, end_time))
+
+        def fetch_batch(batch: tuple) -> Optional[tuple]:
+            batch_queries, start_time, end_time = batch
+            try:
+                return self._get_metric_data(
+                    [query for query, _, _ in batch_queries], start_time, end_time, by_label=True
+                )
+            except Exception as e:
+                print(f"Error getting metric data for batch of {len(batch_queries)} search queries: {e}")
+                return None
+
+        batch_results = map_concurrently(fetch_batch, batches, config.CLOUDWATCH_MAX_WORKERS)
+
+        series_datapoints = [{} for _ in requests]
+        for (batch_queries, _, _), batch_result in zip(batches, batch_results):
+            results, failed_query_ids = batch_result or ({}, {query['Id'] for query, _, _ in batch_queries})
 
-    def _process_metric_datapoints(self, datapoints: List[Dict], avg_stat: str) -> Dict:
-        """Process CloudWatch datapoints and calculate statistics with sustained peak analysis"""
+            # (query id, InstanceId label) -> (request indexes, statistic) for every series asked for in the batch
+            result_index = {}
+            for query, chunk_indexes, statistic in batch_queries:
+                for instance_id, request_indexes in chunk_indexes.items():
+                    if query['Id'] in failed_query_ids:
+                        for request_index in request_indexes:
+                            series_datapoints[request_index] = None
+                    else:
+                        result_index[(query['Id'], instance_id)] = (request_indexes, statistic)
+
+            for result_key, values_by_time in results.items():
+                # Ignore series for instances that were not asked for in the expression
+                if result_key not in result_index:
+                    continue
+                request_indexes, statistic = result_index[result_key]
+                for request_index in request_indexes:
+                    datapoints_by_time = series_datapoints[request_index]
+                    if datapoints_by_time is None:
+                        continue
+                    for timestamp, value in values_by_time.items():
+                        datapoints_by_time.setdefault(timestamp, {'Timestamp': timestamp})[statistic] = value
+
+        # Convert {timestamp: datapoint} maps into datapoint lists over each request's own range
+        return [
+            self._window_datapoints(by_time, start_time, end_time, period) if by_time is not None else None
+            for by_time, (_, start_time, end_time) in zip(series_datapoints, requests)
+        ]
+
+    def _chunk_search_instances(self, metric_key: str, instance_ids: List[str], period: int) -> List[List[str]]:
+        """Split instance IDs so every SEARCH expression stays within the expression length limit"""
+        # Longest statistic name gives the longest expression
+        longest_statistic = max(METRIC_STATISTICS.values(), key=len)
+        base_length = len(self._build_search_expression(metric_key, [], longest_statistic, period))
+
+        chunks = []
+        chunk = []
+        length = base_length
+        for instance_id in instance_ids:
+            term_length = len(f'InstanceId="{instance_id}"') + (len(' OR ') if chunk else 0)
+            if chunk and length + term_length > config.CLOUDWATCH_SEARCH_EXPRESSION_MAX_LENGTH:
+                chunks.append(chunk)
+                chunk = []
+                length = base_length
+                term_length = len(f'InstanceId="{instance_id}"')
+            chunk.append(instance_id)
+            length += term_length
+        if chunk:
+            chunks.append(chunk)
+
+        return chunks
+
+    def _build_search_expression(self, metric_key: str, instance_ids: List[str], statistic: str, period: int) -> str:
+        """Build a SEARCH expression matching a metric for the given instances (by InstanceId dimension)"""
+        namespace, metric_name = METRIC_SOURCES[metric_key]
+        instance_filter = ' OR '.join(f'InstanceId="{instance_id}"' for instance_id in instance_ids)
+        return (
+            f"SEARCH('{{{namespace},InstanceId}} MetricName=\"{metric_name}\" ({instance_filter})', "
+            f"'{statistic}', {period})"
+        )
+
+    def _cache_key(self, instance_id: str, metric_key: str, period: int) -> tuple:
+        """Metric cache key for an instance metric series"""
+        namespace, metric_name = METRIC_SOURCES[metric_key]
+        return (instance_id, namespace, metric_name, period)
+
+    def _get_metric_data(
+        self,
+        queries: List[Dict],
+        start_time: datetime,
+        end_time: datetime,
+        by_label: bool = False
+    ) -> tuple:
+        """
+        Run a single GetMetricData request, following NextToken until all pages are read.
+        Returns tuple of ({query_id: {timestamp: value}}, set of failed query ids), keyed by
+        (query_id, label) instead if by_label is set (for expressions that return several series
+        under one query id). Queries with a FAILED_QUERY_STATUS_CODES status are failed.
+        """
+        results = {}
+        failed_query_ids = set()
+        paginator = self.cloudwatch_client.get_paginator('get_metric_data')
+
+        with _in_flight_requests:
+            for page in paginator.paginate(
+                MetricDataQueries=queries,
+                StartTime=start_time,
+                EndTime=end_time,
+                ScanBy='TimestampAscending'
+            ):
+                for result in page['MetricDataResults']:
+                    result_key = (result['Id'], result.get('Label')) if by_label else result['Id']
+                    values_by_time = results.setdefault(result_key, {})
+                    values_by_time.update(zip(result.get('Timestamps', []), result.get('Values', [])))
+
+                    if result.get('StatusCode') in FAILED_QUERY_STATUS_CODES:
+                        print(f"Metric data query {result['Id']} returned {result['StatusCode']}")
+                        failed_query_ids.add(result['Id'])
+
+                for message in page.get('Messages', []):
+                    print(f"GetMetricData message: {message.get('Code')}: {message.get('Value')}")
+
+        return results, failed_query_ids
+
+    def _process_metric_datapoints(self, datapoints: List[Dict], avg_stat: str, period: int = None) -> Dict:
+        """
+        Process CloudWatch datapoints and calculate statistics with sustained peak analysis.
+        period is the datapoint period in seconds (defaults to CLOUDWATCH_PERIOD_SECONDS).
+        """
         if not datapoints:
             return self._empty_metrics()
 
-        # Extract values
-        averages = [dp[avg_stat] for dp in datapoints if avg_stat in dp]
-        maximums = [dp['Maximum'] for dp in datapoints if 'Maximum' in dp]
-        minimums = [dp['Minimum'] for dp in datapoints if 'Minimum' in dp]
+        # Read every datapoint once, then load all statistics into one (3 x datapoints) float array, NaN where missing
+        averages, maximums, minimums = [], [], []
+        for dp in datapoints:
+            averages.append(dp.get(avg_stat, np.nan))
+            maximums.append(dp.get('Maximum', np.nan))
+            minimums.append(dp.get('Minimum', np.nan))
+        values = np.array((averages, maximums, minimums), dtype=float)
+        averages = values[0][~np.isnan(values[0])]
+        maximums = values[1]
+        minimums = values[2]
 
-        if not averages:
+        if not averages.size:
             return self._empty_metrics()
 
-        # Calculate basic statistics
-        avg_value = np.mean(averages)
-        max_value = max(maximums) if maximums else max(averages)
-        min_value = min(minimums) if minimums else min(averages)
-
-        # Calculate multiple percentiles for sustained peak analysis
-        p75_value = np.percentile(averages, 75)
-        p90_value = np.percentile(averages, 90)
-        p95_value = np.percentile(averages, 95)
-        p99_value = np.percentile(averages, 99)
-
-        # Calculate duration above thresholds (in minutes)
-        # Each datapoint represents CLOUDWATCH_PERIOD_SECONDS
-        period_minutes = config.CLOUDWATCH_PERIOD_SECONDS / 60
-        duration_above = {}
-        for threshold in config.UTILIZATION_THRESHOLDS:
-            count_above = sum(1 for v in averages if v >= threshold)
-            duration_above[threshold] = round(count_above * period_minutes, 1)
+        # Calculate basic statistics (convert to native Python floats for JSON serialization)
+        avg_value = float(averages.mean())
+        max_value = float(np.nanmax(maximums)) if not np.isnan(maximums).all() else float(averages.max())
+        min_value = float(np.nanmin(minimums)) if not np.isnan(minimums).all() else float(averages.min())
+
+        # Calculate multiple percentiles for sustained peak analysis in one call
+        p75_value, p90_value, p95_value, p99_value = (
+            float(v) for v in np.percentile(averages, [75, 90, 95, 99])
+        )
+
+        # Calculate duration above thresholds (in minutes) with one broadcasted comparison
+        # Each datapoint represents one period
+        period_minutes = (period or config.CLOUDWATCH_PERIOD_SECONDS) / 60
+        thresholds = np.asarray(config.UTILIZATION_THRESHOLDS, dtype=float)
+        counts_above = (averages[:, np.newaxis] >= thresholds).sum(axis=0)
+        duration_above = {
+            threshold: round(int(count) * period_minutes, 1)
+            for threshold, count in zip(config.UTILIZATION_THRESHOLDS, counts_above)
+        }
 
         # Detect if P95 is a spike (large gap between P90 and P95)
         spike_gap = p95_value - p90_value
@@ -138,26 +762,14 @@ class CloudWatchService:
 
         # Determine sustained peak and which percentile to use for sizing
         # Check if P95 was sustained for at least the threshold duration
-        sustained_threshold = config.SUSTAINED_PEAK_THRESHOLD_MINUTES
         p95_threshold = p95_value * 0.95  # Consider values within 5% of P95 as "at P95 level"
-        count_at_p95_level = sum(1 for v in averages if v >= p95_threshold)
+        count_at_p95_level = int(np.count_nonzero(averages >= p95_threshold))
         duration_at_p95_level = count_at_p95_level * period_minutes
 
         # Select effective peak for sizing
-        if duration_at_p95_level >= sustained_threshold and not is_spike:
-            effective_peak = p95_value
-            peak_type = 'sustained'
-            effective_peak_percentile = 'P95'
-        elif duration_above.get(80, 0) >= sustained_threshold:
-            # P95 wasn't sustained, check if P90 level was
-            effective_peak = p90_value
-            peak_type = 'moderate'
-            effective_peak_percentile = 'P90'
-        else:
-            # Neither was sustained, use P75 for more conservative sizing
-            effective_peak = p75_value
-            peak_type = 'momentary'
-            effective_peak_percentile = 'P75'
+        effective_peak, peak_type, effective_peak_percentile = self._select_effective_peak(
+            p75_value, p90_value, p95_value, is_spike, duration_at_p95_level, duration_above
+        )
 
         return {
             'average': round(avg_value, 2),
@@ -167,7 +779,7 @@ class CloudWatchService:
             'p99': round(p99_value, 2),
             'max': round(max_value, 2),
             'min': round(min_value, 2),
-            'datapoints': len(averages),
+            'datapoints': int(averages.size),
             'available': True,
             # Sustained peak analysis
             'effective_peak': round(effective_peak, 2),
@@ -179,6 +791,30 @@ class CloudWatchService:
             'duration_at_p95_minutes': round(duration_at_p95_level, 1)
         }
 
+    def _select_effective_peak(
+        self,
+        p75_value: float,
+        p90_value: float,
+        p95_value: float,
+        is_spike: bool,
+        duration_at_p95_level: float,
+        duration_above: Dict
+    ) -> tuple:
+        """
+        Select the effective peak used for sizing.
+        Returns tuple of (effective peak, peak type, percentile label)
+        """
+        sustained_threshold = config.SUSTAINED_PEAK_THRESHOLD_MINUTES
+
+        if duration_at_p95_level >= sustained_threshold and not is_spike:
+            return p95_value, 'sustained', 'P95'
+        elif duration_above.get(80, 0) >= sustained_threshold:
+            # P95 wasn't sustained, check if P90 level was
+            return p90_value, 'moderate', 'P90'
+        else:
+            # Neither was sustained, use P75 for more conservative sizing
+            return p75_value, 'momentary', 'P75'
+
     def _empty_metrics(self) -> Dict:
         """Return empty metrics structure"""
         return {
@@ -205,110 +841,403 @@ class CloudWatchService:
         self,
         instance_ids: List[str],
         start_time: datetime,
-        end_time: datetime = None
+        end_time: datetime = None,
+        period: int = None,
+        instance_windows: Optional[Dict[str, tuple]] = None
     ) -> Dict:
         """
         Get aggregated metrics across multiple instances (for instance groups).
-        Calculates weighted average across all instances with sustained peak analysis.
+        Pools the raw datapoints of all instances with sustained peak analysis, or, when metric
+        rollups are enabled, merges the instances' hourly sketches (see _collect_instance_sketches).
+        If period is None, it is chosen by plan_period for the window; rollups always summarize
+        CLOUDWATCH_PERIOD_SECONDS datapoints, so results from rollups report that period.
+        instance_windows optionally maps instance_id -> (launched_at, terminated_at); each instance
+        is then only queried for the part of the window it was running.
         """
         if not instance_ids:
             return {
                 'instance_count': 0,
+                'instances_in_window': 0,
                 'instances_with_metrics': 0,
+                'instance_hours': 0,
                 'cpu': self._empty_metrics(),
                 'memory': self._empty_metrics(),
-                'per_instance': []
+                'per_instance': [],
+                'period_seconds': period or config.CLOUDWATCH_PERIOD_SECONDS
             }
 
-        all_cpu_metrics = []
-        all_memory_metrics = []
-        per_instance_metrics = []
-        instances_with_metrics = 0
+        if end_time is None:
+            end_time = datetime.now(timezone.utc)
 
-        for instance_id in instance_ids:
-            metrics = self.get_instance_metrics(instance_id, start_time, end_time)
-            per_instance_metrics.append(metrics)
+        # Ensure timezone awareness
+        if start_time.tzinfo is None:
+            start_time = start_time.replace(tzinfo=timezone.utc)
+        if end_time.tzinfo is None:
+            end_time = end_time.replace(tzinfo=timezone.utc)
 
-            if metrics['metrics_available']:
-                instances_with_metrics += 1
+        if period is None:
+            period = self.plan_period(start_time, end_time)
+        if self.rollup_store:
+            period = config.CLOUDWATCH_PERIOD_SECONDS
 
-                if metrics['cpu']['available']:
-                    all_cpu_metrics.append(metrics['cpu'])
+        series_windows = self._clip_instance_windows(instance_ids, start_time, end_time, period, instance_windows)
+        unique_instance_ids = list(dict.fromkeys(instance_ids))
 
-                if metrics['memory']['available']:
-                    all_memory_metrics.append(metrics['memory'])
+        # Per-instance and aggregated statistics with sustained peak analysis
+        if self.rollup_store:
+            sketches = self._collect_instance_sketches(unique_instance_ids, series_windows)
+            instance_statistics = {
+                instance_id: [
+                    self._summarize_sketches([sketches[(instance_id, metric_key)]], period)
+                    for metric_key in ('cpu', 'memory')
+                ]
+                for instance_id in unique_instance_ids
+            }
+            aggregated_cpu = self._summarize_sketches(
+                [sketches[(instance_id, 'cpu')] for instance_id in unique_instance_ids], period
+            )
+            aggregated_memory = self._summarize_sketches(
+                [sketches[(instance_id, 'memory')] for instance_id in unique_instance_ids], period
+            )
+        else:
+            datapoints = self._collect_instance_series(instance_ids, start_time, end_time, period, series_windows)
+            instance_statistics = {
+                instance_id: [
+                    self._process_metric_datapoints(datapoints.get((instance_id, metric_key), []), 'Average', period)
+                    for metric_key in ('cpu', 'memory')
+                ]
+                for instance_id in unique_instance_ids
+            }
+            aggregated_cpu = self._aggregate_values(
+                [datapoints[(instance_id, 'cpu')] for instance_id in unique_instance_ids], period=period
+            )
+            aggregated_memory = self._aggregate_values(
+                [datapoints[(instance_id, 'memory')] for instance_id in unique_instance_ids], period=period
+            )
 
-        # Calculate aggregated metrics with sustained peak analysis
-        aggregated_cpu = self._aggregate_values(all_cpu_metrics)
-        aggregated_memory = self._aggregate_values(all_memory_metrics)
+        per_instance_metrics = [
+            self._instance_metrics_entry(
+                instance_id, *instance_statistics[instance_id], *(series_windows[instance_id] or (start_time, end_time))
+            )
+            for instance_id in instance_ids
+        ]
+        windows_in_range = [window for window in series_windows.values() if window]
+        instance_hours = sum((end - start).total_seconds() for start, end in windows_in_range) / 3600
+        instances_with_metrics = sum(1 for metrics in per_instance_metrics if metrics['metrics_available'])
 
         return {
             'instance_count': len(instance_ids),
+            'instances_in_window': len(windows_in_range),
             'instances_with_metrics': instances_with_metrics,
+            'instance_hours': round(instance_hours, 1),
             'cpu': aggregated_cpu,
             'memory': aggregated_memory,
-            'per_instance': per_instance_metrics
+            'per_instance': per_instance_metrics,
+            'period_seconds': period
         }
 
-    def _aggregate_values(
+    def _collect_instance_sketches(
         self,
-        instance_metrics: List[Dict]
-    ) -> Dict:
-        """Aggregate values across multiple instances with sustained peak analysis"""
-        if not instance_metrics:
+        instance_ids: List[str],
+        series_windows: Dict[str, Optional[tuple]]
+    ) -> Dict[tuple, MetricSketch]:
+        """
+        Get a merged MetricSketch of CLOUDWATCH_PERIOD_SECONDS datapoints per (instance_id, metric key)
+        series over its window. Windows are rolled up one METRIC_ROLLUP_SLICE_SECONDS-aligned slice at
+        a time (see _add_window_sketches), so memory does not grow with the lookback.
+        Series whose fetch failed are returned with whatever was stored.
+        """
+        settled = int(time.time() - config.METRIC_CACHE_SETTLE_SECONDS)
+        settled_hour = settled - settled % 3600
+
+        sketches = {
+            (instance_id, metric_key): MetricSketch() for instance_id in instance_ids for metric_key in METRIC_SOURCES
+        }
+        windows = [series_windows[instance_id] for instance_id in instance_ids if series_windows[instance_id]]
+        if not windows:
+            return sketches
+
+        slice_seconds = config.METRIC_ROLLUP_SLICE_SECONDS
+        slice_start = int(min(start_time for start_time, _ in windows).timestamp()) // slice_seconds * slice_seconds
+        windows_end = max(end_time for _, end_time in windows)
+        while self._to_datetime(slice_start) < windows_end:
+            slice_windows = {}
+            for instance_id in instance_ids:
+                if not series_windows[instance_id]:
+                    continue
+                start_time = max(series_windows[instance_id][0], self._to_datetime(slice_start))
+                end_time = min(series_windows[instance_id][1], self._to_datetime(slice_start + slice_seconds))
+                if start_time < end_time:
+                    slice_windows[instance_id] = (start_time, end_time)
+            self._add_window_sketches(sketches, slice_windows, settled_hour)
+            slice_start += slice_seconds
+
+        return sketches
+
+    def _add_window_sketches(
+        self,
+        sketches: Dict[tuple, MetricSketch],
+        series_windows: Dict[str, tuple],
+        settled_hour: int
+    ):
+        """
+        Merge each instance's datapoints over its window into its series' sketches. Whole hours before
+        settled_hour come from the rollup store, looked up for all series at once. Only the rest of
+        each window is fetched, through the metric cache: the partial leading hour, the hours not
+        rolled up yet and the unsettled tail, with adjacent ranges merged. Fetched hours not rolled up
+        yet are summarized and stored; the partial and unsettled hours are summarized without storing.
+        """
+        base_period = config.CLOUDWATCH_PERIOD_SECONDS
+
+        hours_by_series = {}  # series -> whole settled hours (epoch seconds) of its window
+        for instance_id, (start_time, end_time) in series_windows.items():
+            first_hour = int(-(-start_time.timestamp() // 3600) * 3600)
+            hours_end = min(int(end_time.timestamp() // 3600 * 3600), settled_hour)
+            for metric_key in METRIC_SOURCES:
+                hours_by_series[(instance_id, metric_key)] = list(range(first_hour, hours_end, 3600))
+
+        rollup_keys = {series: self._cache_key(*series, base_period) for series in hours_by_series}
+        stored = self.rollup_store.get_many(
+            {rollup_keys[series]: hours for series, hours in hours_by_series.items()}
+        )
+
+        requests = []
+        for series, hours in hours_by_series.items():
+            # Hours stored at another METRIC_ROLLUP_RELATIVE_ACCURACY cannot be merged; they are rebuilt
+            stored_hours = {
+                hour: sketch
+                for hour, sketch in stored[rollup_keys[series]].items()
+                if sketch.relative_accuracy == config.METRIC_ROLLUP_RELATIVE_ACCURACY
+            }
+            for sketch in stored_hours.values():
+                sketches[series].merge(sketch)
+
+            for fetch_start, fetch_end in self._uncovered_ranges(*series_windows[series[0]], hours, stored_hours):
+                requests.append((series, fetch_start, fetch_end))
+
+        rollups = []
+        for (series, start_time, end_time), datapoints in zip(
+            requests, self._get_range_datapoints(requests, base_period)
+        ):
+            # Failed fetches are not rolled up so the hours are fetched again next time
+            if datapoints is None:
+                continue
+
+            # Whole settled hours of the range are not stored yet; hours without datapoints are stored
+            # too, so they are not fetched again
+            hourly = {
+                hour: MetricSketch()
+                for hour in hours_by_series[series]
+                if start_time.timestamp() <= hour < end_time.timestamp()
+            }
+            for dp in datapoints:
+                timestamp = int(dp['Timestamp'].timestamp())
+                hour = timestamp - timestamp % 3600
+                if hour in hourly:
+                    hourly[hour].add_datapoints([dp])
+                else:
+                    sketches[series].add_datapoints([dp])
+            for hour, sketch in hourly.items():
+                rollups.append((rollup_keys[series], hour, sketch))
+                sketches[series].merge(sketch)
+
+        try:
+            self.rollup_store.store(rollups)
+        except Exception as e:
+            print(f"Error storing metric rollups: {e}")
+
+    def _uncovered_ranges(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        hours: List[int],
+        stored_hours: Dict[int, MetricSketch]
+    ) -> List[tuple]:
+        """
+        Get the (start, end) ranges of a window not covered by its stored hours: the partial leading
+        hour, each run of whole settled hours not stored and everything after the last settled hour
+        """
+        if not hours:
+            return [(start_time, end_time)]
+
+        pieces = [(start_time, self._to_datetime(hours[0]))]
+        pieces += [
+            (self._to_datetime(hour), self._to_datetime(hour + 3600)) for hour in hours if hour not in stored_hours
+        ]
+        pieces.append((self._to_datetime(hours[-1] + 3600), end_time))
+
+        ranges = []
+        for piece_start, piece_end in pieces:
+            if piece_start >= piece_end:
+                continue
+            if ranges and ranges[-1][1] == piece_start:
+                ranges[-1] = (ranges[-1][0], piece_end)
+            else:
+                ranges.append((piece_start, piece_end))
+        return ranges
+
+    @staticmethod
+    def _to_datetime(epoch: int) -> datetime:
+        """Convert epoch seconds to a timezone-aware datetime"""
+        return datetime.fromtimestamp(epoch, timezone.utc)
+
+    def _summarize_sketches(self, sketches: List[MetricSketch], period: int = None) -> Dict:
+        """
+        Statistics with sustained peak analysis (same shape as _process_metric_datapoints) from
+        per-instance sketches. Percentiles come from the merged sketch; threshold durations are
+        per instance, averaged weighted by instance-hours as in _aggregate_values.
+        """
+        merged = MetricSketch.merged(sketches)
+        if not merged.count:
             return self._empty_metrics()
 
-        # Extract values from instance metrics
-        averages = [m['average'] for m in instance_metrics if m.get('average') is not None]
-        p75_values = [m['p75'] for m in instance_metrics if m.get('p75') is not None]
-        p90_values = [m['p90'] for m in instance_metrics if m.get('p90') is not None]
-        p95_values = [m['p95'] for m in instance_metrics if m.get('p95') is not None]
-        p99_values = [m['p99'] for m in instance_metrics if m.get('p99') is not None]
-        effective_peaks = [m['effective_peak'] for m in instance_metrics if m.get('effective_peak') is not None]
+        avg_value = merged.sum / merged.count
+        p75_value, p90_value, p95_value, p99_value = merged.quantiles([0.75, 0.90, 0.95, 0.99])
+
+        period_minutes = (period or config.CLOUDWATCH_PERIOD_SECONDS) / 60
+        reporting = [sketch for sketch in sketches if sketch.count]
+
+        def weighted_count_at_or_above(value: float) -> float:
+            return sum(sketch.count * sketch.count_at_or_above(value) for sketch in reporting) / merged.count
+
+        duration_above = {
+            threshold: round(weighted_count_at_or_above(threshold) * period_minutes, 1)
+            for threshold in config.UTILIZATION_THRESHOLDS
+        }
+
+        # Detect if P95 is a spike (large gap between P90 and P95)
+        spike_gap = p95_value - p90_value
+        is_spike = bool(spike_gap > config.SPIKE_DETECTION_GAP_PERCENT)
+
+        # Time each instance spent within 5% of the pooled P95
+        duration_at_p95_level = weighted_count_at_or_above(p95_value * 0.95) * period_minutes
+
+        effective_peak, peak_type, effective_peak_percentile = self._select_effective_peak(
+            p75_value, p90_value, p95_value, is_spike, duration_at_p95_level, duration_above
+        )
+
+        return {
+            'average': round(avg_value, 2),
+            'p75': round(p75_value, 2),
+            'p90': round(p90_value, 2),
+            'p95': round(p95_value, 2),
+            'p99': round(p99_value, 2),
+            'max': round(merged.max, 2),
+            'min': round(merged.min, 2),
+            'datapoints': merged.count,
+            'instance_hours': round(merged.count * period_minutes / 60, 1),
+            'available': True,
+            # Sustained peak analysis
+            'effective_peak': round(effective_peak, 2),
+            'effective_peak_percentile': effective_peak_percentile,
+            'peak_type': peak_type,
+            'is_spike': is_spike,
+            'spike_gap': round(spike_gap, 2),
+            'duration_above': duration_above,
+            'duration_at_p95_minutes': round(duration_at_p95_level, 1)
+        }
+
+    def _clip_instance_windows(
+        self,
+        instance_ids: List[str],
+        start_time: datetime,
+        end_time: datetime,
+        period: int,
+        instance_windows: Optional[Dict[str, tuple]] = None
+    ) -> Dict[str, Optional[tuple]]:
+        """
+        Clip the query window to each instance's lifetime.
+        instance_windows maps instance_id -> (launched_at, terminated_at), None where unknown or still running.
+        Returns {instance_id: (start, end)}, or None for instances that were not running during the window.
+        Launch times are rounded down to the period so the launch bucket is kept.
+        """
+        windows = {}
+        for instance_id in dict.fromkeys(instance_ids):
+            launched_at, terminated_at = (instance_windows or {}).get(instance_id, (None, None))
+            series_start, series_end = start_time, end_time
+            if launched_at:
+                epoch = int(launched_at.timestamp())
+                series_start = max(start_time, datetime.fromtimestamp(epoch - epoch % period, timezone.utc))
+            if terminated_at:
+                series_end = min(end_time, terminated_at)
+            windows[instance_id] = (series_start, series_end) if series_start < series_end else None
+        return windows
+
+    def _aggregate_values(
+        self,
+        instance_datapoints: List[List[Dict]],
+        avg_stat: str = 'Average',
+        period: int = None
+    ) -> Dict:
+        """
+        Aggregate raw datapoints across multiple instances with sustained peak analysis.
+        Datapoints are aligned on an instances x timestamps grid (NaN for gaps), so percentiles
+        are pooled over every instance sample and threshold durations are computed in one pass.
+        Pooling weights each instance by its instance-hours, so instances that only ran for part of
+        the window (see _clip_instance_windows) count in proportion to the time they ran.
+        """
+        # Flatten all series into parallel arrays
+        rows, timestamps, averages, maximums, minimums = [], [], [], [], []
+        for row, datapoints in enumerate(instance_datapoints):
+            for dp in datapoints:
+                if avg_stat in dp:
+                    rows.append(row)
+                    timestamps.append(dp['Timestamp'].timestamp())
+                    averages.append(dp[avg_stat])
+                    maximums.append(dp.get('Maximum', np.nan))
+                    minimums.append(dp.get('Minimum', np.nan))
 
         if not averages:
             return self._empty_metrics()
 
-        # Calculate aggregated basic stats (convert to native Python floats for JSON serialization)
-        avg_value = float(np.mean(averages))
-        p75_value = float(np.mean(p75_values) if p75_values else np.percentile(averages, 75))
-        p90_value = float(np.mean(p90_values) if p90_values else np.percentile(averages, 90))
-        p95_value = float(np.mean(p95_values) if p95_values else np.percentile(averages, 95))
-        p99_value = float(np.mean(p99_values) if p99_values else np.percentile(averages, 99))
-        effective_peak = float(np.mean(effective_peaks) if effective_peaks else p95_value)
-
-        # Aggregate duration above thresholds
-        duration_above = {}
-        for threshold in config.UTILIZATION_THRESHOLDS:
-            durations = [m.get('duration_above', {}).get(threshold, 0) for m in instance_metrics]
-            if durations:
-                duration_above[threshold] = round(float(np.mean(durations)), 1)
-
-        # Aggregate duration at P95
-        duration_at_p95_list = [m.get('duration_at_p95_minutes', 0) for m in instance_metrics]
-        duration_at_p95_avg = float(np.mean(duration_at_p95_list)) if duration_at_p95_list else 0
-
-        # Determine aggregate spike detection
-        spike_gaps = [m.get('spike_gap', 0) for m in instance_metrics if m.get('spike_gap') is not None]
-        avg_spike_gap = float(np.mean(spike_gaps)) if spike_gaps else 0
-        is_spike = bool(avg_spike_gap > config.SPIKE_DETECTION_GAP_PERCENT)
-
-        # Determine aggregate peak type based on most common type
-        peak_types = [m.get('peak_type') for m in instance_metrics if m.get('peak_type')]
-        if peak_types:
-            # Use the most conservative (worst case) peak type
-            if 'momentary' in peak_types:
-                peak_type = 'momentary'
-                effective_peak_percentile = 'P75'
-            elif 'moderate' in peak_types:
-                peak_type = 'moderate'
-                effective_peak_percentile = 'P90'
-            else:
-                peak_type = 'sustained'
-                effective_peak_percentile = 'P95'
-        else:
-            peak_type = 'sustained'
-            effective_peak_percentile = 'P95'
+        # Align datapoints on a common timestamp grid
+        grid, columns = np.unique(np.asarray(timestamps), return_inverse=True)
+        matrix = np.full((len(instance_datapoints), len(grid)), np.nan)
+        matrix[rows, columns] = averages
+
+        present = ~np.isnan(matrix)
+        instance_rows = present.any(axis=1)
+        matrix = matrix[instance_rows]
+        present = present[instance_rows]
+        values = matrix[present]
+
+        # Pooled statistics over every instance sample (convert to native Python floats for JSON serialization)
+        avg_value = float(values.mean())
+        p75_value, p90_value, p95_value, p99_value = (float(v) for v in np.percentile(values, [75, 90, 95, 99]))
+
+        maximums = np.asarray(maximums)
+        minimums = np.asarray(minimums)
+        max_value = float(np.nanmax(maximums)) if not np.isnan(maximums).all() else float(values.max())
+        min_value = float(np.nanmin(minimums)) if not np.isnan(minimums).all() else float(values.min())
+
+        # Per-timestamp group mean across the instances reporting at that time
+        reporting = present.sum(axis=0)
+        group_mean = np.nansum(matrix, axis=0)[reporting > 0] / reporting[reporting > 0]
+
+        # Duration above thresholds (in minutes) per instance, averaged weighted by instance-hours
+        # (datapoints reported); NaN gaps compare as False, so they never count as time above a threshold
+        period_minutes = (period or config.CLOUDWATCH_PERIOD_SECONDS) / 60
+        instance_weights = present.sum(axis=1)
+        thresholds = np.asarray(config.UTILIZATION_THRESHOLDS, dtype=float)
+        counts_above = np.average(
+            (matrix[:, :, np.newaxis] >= thresholds).sum(axis=1), axis=0, weights=instance_weights
+        )
+        duration_above = {
+            threshold: round(float(count) * period_minutes, 1)
+            for threshold, count in zip(config.UTILIZATION_THRESHOLDS, counts_above)
+        }
+
+        # Detect if P95 is a spike (large gap between P90 and P95)
+        spike_gap = p95_value - p90_value
+        is_spike = bool(spike_gap > config.SPIKE_DETECTION_GAP_PERCENT)
+
+        # Time each instance spent within 5% of the pooled P95
+        count_at_p95_level = float(np.average((matrix >= p95_value * 0.95).sum(axis=1), weights=instance_weights))
+        duration_at_p95_level = count_at_p95_level * period_minutes
+
+        effective_peak, peak_type, effective_peak_percentile = self._select_effective_peak(
+            p75_value, p90_value, p95_value, is_spike, duration_at_p95_level, duration_above
+        )
 
         return {
             'average': round(avg_value, 2),
@@ -316,20 +1245,45 @@ class CloudWatchService:
             'p90': round(p90_value, 2),
             'p95': round(p95_value, 2),
             'p99': round(p99_value, 2),
-            'max': round(max(averages), 2),
-            'min': round(min(averages), 2),
-            'datapoints': len(averages),
+            'max': round(max_value, 2),
+            'min': round(min_value, 2),
+            'datapoints': int(values.size),
+            'instance_hours': round(values.size * period_minutes / 60, 1),
             'available': True,
             # Sustained peak analysis
             'effective_peak': round(effective_peak, 2),
             'effective_peak_percentile': effective_peak_percentile,
             'peak_type': peak_type,
             'is_spike': is_spike,
-            'spike_gap': round(avg_spike_gap, 2),
+            'spike_gap': round(spike_gap, 2),
             'duration_above': duration_above,
-            'duration_at_p95_minutes': round(duration_at_p95_avg, 1)
+            'duration_at_p95_minutes': round(duration_at_p95_level, 1),
+            'group_mean_peak': round(float(group_mean.max()), 2)
         }
 
+    def plan_period(self, start_time: datetime, end_time: datetime = None) -> int:
+        """
+        Choose the metric period for a time window.
+        Keeps CLOUDWATCH_PERIOD_SECONDS unless the window would exceed CLOUDWATCH_TARGET_DATAPOINTS
+        per series, then steps to the coarsest candidate period that is still no longer than
+        SUSTAINED_PEAK_THRESHOLD_MINUTES, so sustained peak detection keeps working.
+        """
+        if end_time is None:
+            end_time = datetime.now(timezone.utc)
+
+        window_seconds = (end_time - start_time).total_seconds()
+        base_period = config.CLOUDWATCH_PERIOD_SECONDS
+        max_period = max(base_period, config.SUSTAINED_PEAK_THRESHOLD_MINUTES * 60)
+
+        period = base_period
+        for candidate in sorted(config.CLOUDWATCH_PERIOD_CANDIDATES):
+            if window_seconds / period <= config.CLOUDWATCH_TARGET_DATAPOINTS:
+                break
+            if base_period < candidate <= max_period:
+                period = candidate
+
+        return period
+
     def calculate_lookback_time(
         self,
         cluster_type: str,
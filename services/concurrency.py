@@ -0,0 +1,58 @@
+"""
+Helpers for running AWS calls on bounded worker pools
+"""
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, List
+
+
+def map_concurrently(func: Callable, items: Iterable, max_workers: int) -> List:
+    """
+    Apply func to every item on a bounded thread pool.
+    Results are returned in input order. Exceptions are not caught here,
+    so func should handle its own per-item errors.
+    Each call runs in a copy of the caller's context, so context variables
+    (such as the current analysis' API usage tracker) carry over to the workers.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    workers = max(1, min(max_workers, len(items)))
+    if workers == 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+        return [future.result() for future in futures]
+
+
+def imap_as_completed(func: Callable, items: Iterable, max_workers: int, window: int = None) -> Iterator:
+    """
+    Apply func to every item on a bounded thread pool, yielding (item, result) as each call finishes.
+    At most window calls (default 2 x max_workers) are submitted ahead, so items are consumed lazily
+    and memory stays bounded however many items there are. As with map_concurrently, func should
+    handle its own per-item errors, and each call runs in a copy of the caller's context.
+    If the consumer stops early, calls that have not started are cancelled.
+    """
+    items = iter(items)
+    window = max(1, window or 2 * max_workers)
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    pending = {}
+    try:
+        while True:
+            # Top up the window of submitted calls
+            for item in items:
+                pending[executor.submit(contextvars.copy_context().run, func, item)] = item
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -0,0 +1,87 @@
+"""
+EC2 Service for instance details
+Describes instances in batches and caches the fields that never change for an instance
+"""
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional
+import config
+from services.aws_client import get_client
+from services.concurrency import map_concurrently
+
+
+class EC2Service:
+    """Service for EC2 instance details"""
+
+    def __init__(self, target: Optional[Dict] = None):
+        # Instances are described in the account/region of the target (see config.AWS_TARGETS)
+        self.ec2_client = get_client('ec2', target)
+
+        # instance id -> details; type, launch time and private IP never change for an instance
+        self._details: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_instance_details(self, instance_ids: List[str], refresh_state: bool = False) -> List[Dict]:
+        """
+        Get EC2 details (instance_id, instance_type, launch_time, private_ip, state) for instances.
+        Instances described before are served from the cache with their last known state,
+        unless refresh_state is set. Unknown instance IDs are skipped.
+        Returns details in input order.
+        """
+        instance_ids = list(dict.fromkeys(instance_ids))
+        if not instance_ids:
+            return []
+
+        with self._lock:
+            missing = [
+                instance_id for instance_id in instance_ids
+                if refresh_state or instance_id not in self._details
+            ]
+
+        if missing:
+            described = self._describe_instances(missing)
+            with self._lock:
+                for details in described:
+                    self._details[details['instance_id']] = details
+                    self._details.move_to_end(details['instance_id'])
+                while len(self._details) > config.EC2_DETAILS_CACHE_MAX_ENTRIES:
+                    self._details.popitem(last=False)
+
+        with self._lock:
+            return [dict(self._details[instance_id]) for instance_id in instance_ids if instance_id in self._details]
+
+    def _describe_instances(self, instance_ids: List[str]) -> List[Dict]:
+        """
+        Describe instances in chunks of EC2_DESCRIBE_MAX_IDS_PER_REQUEST IDs, fetched concurrently.
+        IDs are passed as an instance-id filter, so IDs that no longer exist are skipped
+        instead of failing the whole request. Chunks that fail are logged and skipped.
+        """
+        chunk_size = config.EC2_DESCRIBE_MAX_IDS_PER_REQUEST
+        chunks = [instance_ids[offset:offset + chunk_size] for offset in range(0, len(instance_ids), chunk_size)]
+
+        def describe_chunk(chunk: List[str]) -> List[Dict]:
+            details = []
+            try:
+                paginator = self.ec2_client.get_paginator('describe_instances')
+                for page in paginator.paginate(
+                    Filters=[{'Name': 'instance-id', 'Values': chunk}],
+                    MaxResults=config.EC2_DESCRIBE_PAGE_SIZE
+                ):
+                    for reservation in page['Reservations']:
+                        for instance in reservation['Instances']:
+                            details.append({
+                                'instance_id': instance['InstanceId'],
+                                'instance_type': instance['InstanceType'],
+                                'launch_time': instance['LaunchTime'].isoformat(),
+                                'private_ip': instance.get('PrivateIpAddress'),
+                                'state': instance['State']['Name']
+                            })
+            except Exception as e:
+                print(f"Error getting EC2 details for {len(chunk)} instances: {e}")
+            return details
+
+        return [
+            details
+            for chunk_details in map_concurrently(describe_chunk, chunks, config.EC2_MAX_WORKERS)
+            for details in chunk_details
+        ]
@@ -3,53 +3,65 @@ EMR Service for cluster operations
 Supports both Instance Groups and Instance Fleets configurations
 """
 import re
-import boto3
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from typing import List, Dict, Optional
 import config
+from services.aws_client import get_client, get_targets
+from services.concurrency import map_concurrently
+from services.ec2_service import EC2Service
 
 
 class EMRService:
     """Service for EMR cluster operations"""
 
-    def __init__(self):
-        session_kwargs = {'region_name': config.AWS_REGION}
-        if config.AWS_PROFILE:
-            session_kwargs['profile_name'] = config.AWS_PROFILE
-
-        self.session = boto3.Session(**session_kwargs)
-        self.emr_client = self.session.client('emr')
-        self.ec2_client = self.session.client('ec2')
+    def __init__(self, target: Optional[Dict] = None):
+        # Account/region this service discovers (see config.AWS_TARGETS)
+        self.target = target or get_targets()[0]
+        self.emr_client = get_client('emr', self.target)
+        self.ec2_service = EC2Service(self.target)
 
         # Compile transient cluster pattern
         self.transient_pattern = re.compile(config.TRANSIENT_CLUSTER_PATTERN)
 
     def list_running_clusters(self) -> List[Dict]:
         """List all running EMR clusters with classification"""
-        clusters = []
-        paginator = self.emr_client.get_paginator('list_clusters')
-
-        for page in paginator.paginate(ClusterStates=['RUNNING', 'WAITING']):
-            for cluster in page['Clusters']:
-                cluster_info = self._get_cluster_details(cluster['Id'])
-                if cluster_info:
-                    clusters.append(cluster_info)
-
-        return clusters
+        cluster_ids = [cluster['Id'] for cluster in self.list_running_cluster_summaries()]
+        return self.hydrate_clusters(cluster_ids)
 
     def list_recently_terminated_clusters(self, hours: int = 3) -> List[Dict]:
         """
         List EMR clusters that were terminated within the last N hours.
         These can still be analyzed using historical CloudWatch metrics.
         """
-        from datetime import timedelta
+        cluster_ids = [cluster['Id'] for cluster in self.list_recently_terminated_cluster_summaries(hours)]
+        return self.hydrate_clusters(cluster_ids, include_terminated=True)
+
+    def list_running_cluster_summaries(self) -> List[Dict]:
+        """List running clusters as returned by ListClusters (id, name, status), without details"""
+        summaries = []
+        paginator = self.emr_client.get_paginator('list_clusters')
 
-        clusters = []
+        for page in paginator.paginate(ClusterStates=['RUNNING', 'WAITING']):
+            summaries.extend(page['Clusters'])
+
+        return summaries
+
+    def list_recently_terminated_cluster_summaries(self, hours: int = 3) -> List[Dict]:
+        """
+        List clusters terminated within the last N hours as returned by ListClusters, without details.
+        Only clusters created within MAX_CLUSTER_RUNTIME_DAYS before the window are considered,
+        so the cost depends on recent churn rather than on the account's whole history.
+        """
+        summaries = []
         cutoff_time = datetime.now(timezone.utc) - timedelta(hours=hours)
+        created_after = cutoff_time - timedelta(days=config.MAX_CLUSTER_RUNTIME_DAYS)
 
         paginator = self.emr_client.get_paginator('list_clusters')
 
-        for page in paginator.paginate(ClusterStates=['TERMINATED', 'TERMINATED_WITH_ERRORS']):
+        for page in paginator.paginate(
+            ClusterStates=['TERMINATED', 'TERMINATED_WITH_ERRORS'],
+            CreatedAfter=created_after
+        ):
             for cluster in page['Clusters']:
                 # Check if terminated within the time window
                 end_time = cluster.get('Status', {}).get('Timeline', {}).get('EndDateTime')
@@ -57,14 +69,43 @@ class EMRService:
                     if end_time.tzinfo is None:
                         end_time = end_time.replace(tzinfo=timezone.utc)
                     if end_time >= cutoff_time:
-                        cluster_info = self._get_cluster_details(cluster['Id'], include_terminated=True)
-                        if cluster_info:
-                            clusters.append(cluster_info)
+                        summaries.append(cluster)
 
-        return clusters
+        return summaries
 
-    def _get_cluster_details(self, cluster_id: str, include_terminated: bool = False) -> Optional[Dict]:
-        """Get detailed information about a cluster"""
+    def hydrate_clusters(
+        self,
+        cluster_ids: List[str],
+        include_terminated: bool = False,
+        include_instances: bool = True
+    ) -> List[Dict]:
+        """
+        Get details for many clusters on a bounded worker pool.
+        Keeps the listing order; clusters that fail to load are skipped.
+        With include_instances=False, groups are summarized without enumerating their instances.
+        """
+        details = map_concurrently(
+            lambda cluster_id: self._get_cluster_details(
+                cluster_id, include_terminated=include_terminated, include_instances=include_instances
+            ),
+            cluster_ids,
+            config.EMR_MAX_WORKERS
+        )
+        return [cluster_info for cluster_info in details if cluster_info]
+
+    def _get_cluster_details(
+        self,
+        cluster_id: str,
+        include_terminated: bool = False,
+        include_instances: bool = True,
+        terminated_after: Optional[datetime] = None
+    ) -> Optional[Dict]:
+        """
+        Get detailed information about a cluster.
+        With include_instances=False, the cluster's EC2 instances are not listed (summary projection):
+        groups keep their types, counts and market but have no ec2_instances/instances.
+        With terminated_after, a running cluster's instances also include those terminated since then.
+        """
         try:
             response = self.emr_client.describe_cluster(ClusterId=cluster_id)
             cluster = response['Cluster']
@@ -91,10 +132,14 @@ class EMRService:
             # Get instances based on collection type
             # For terminated clusters, we still get the configuration but won't have running EC2 instances
             if instance_collection_type == 'INSTANCE_FLEET':
-                instance_groups = self._get_instance_fleets(cluster_id, include_terminated=is_terminated)
+                instance_groups = self._get_instance_fleets(
+                    cluster_id, is_terminated, include_instances, terminated_after
+                )
                 uses_fleets = True
             else:
-                instance_groups = self._get_instance_groups(cluster_id, include_terminated=is_terminated)
+                instance_groups = self._get_instance_groups(
+                    cluster_id, is_terminated, include_instances, terminated_after
+                )
                 uses_fleets = False
 
             result = {
@@ -112,7 +157,11 @@ class EMRService:
                 'release_label': cluster.get('ReleaseLabel', 'Unknown'),
                 'applications': [app['Name'] for app in cluster.get('Applications', [])],
                 'tags': {tag['Key']: tag['Value'] for tag in cluster.get('Tags', [])},
-                'is_terminated': is_terminated
+                'is_terminated': is_terminated,
+                'region': self.target['region'],
+                # Cluster ARN: arn:aws:elasticmapreduce:<region>:<account>:cluster/<id>
+                'account_id': cluster['ClusterArn'].split(':')[4] if cluster.get('ClusterArn') else None,
+                'target': self.target['name']
             }
 
             # Add termination reason for terminated clusters
@@ -173,22 +222,25 @@ class EMRService:
         # Default to transient for shorter-running clusters
         return 'TRANSIENT'
 
-    def _get_instance_groups(self, cluster_id: str, include_terminated: bool = False) -> List[Dict]:
+    def _get_instance_groups(
+        self,
+        cluster_id: str,
+        include_terminated: bool = False,
+        include_instances: bool = True,
+        terminated_after: Optional[datetime] = None
+    ) -> List[Dict]:
         """Get instance groups for a cluster (traditional configuration)"""
         instance_groups = []
 
         try:
             response = self.emr_client.list_instance_groups(ClusterId=cluster_id)
+            instance_index = (
+                self._get_instance_index(cluster_id, include_terminated, terminated_after)
+                if include_instances else None
+            )
 
             for group in response['InstanceGroups']:
-                # Get EC2 instance IDs for this group
-                # For terminated clusters, get historical instances
-                if include_terminated:
-                    ec2_instances = self._get_historical_ec2_instances_for_group(cluster_id, group['Id'])
-                else:
-                    ec2_instances = self._get_ec2_instances_for_group(cluster_id, group['Id'])
-
-                instance_groups.append({
+                group_info = {
                     'id': group['Id'],
                     'name': group.get('Name', group['InstanceGroupType']),
                     'type': group['InstanceGroupType'],  # MASTER, CORE, TASK
@@ -197,32 +249,47 @@ class EMRService:
                     'running_count': group.get('RunningInstanceCount', 0),
                     'market': group.get('Market', 'ON_DEMAND'),
                     'state': group['Status']['State'],
-                    'ec2_instances': ec2_instances,
                     'is_fleet': False
-                })
+                }
+
+                if instance_index is not None:
+                    # EC2 instances of this group (including historical ones, see _get_instance_index)
+                    instances = instance_index.get(group['Id'], [])
+                    group_info['ec2_instances'] = [instance['ec2_instance_id'] for instance in instances]
+                    group_info['instances'] = instances
+
+                instance_groups.append(group_info)
         except Exception as e:
             print(f"Error getting instance groups for {cluster_id}: {e}")
 
         return instance_groups
 
-    def _get_instance_fleets(self, cluster_id: str, include_terminated: bool = False) -> List[Dict]:
+    def _get_instance_fleets(
+        self,
+        cluster_id: str,
+        include_terminated: bool = False,
+        include_instances: bool = True,
+        terminated_after: Optional[datetime] = None
+    ) -> List[Dict]:
         """Get instance fleets for a cluster (fleet configuration)"""
         instance_fleets = []
 
         try:
             response = self.emr_client.list_instance_fleets(ClusterId=cluster_id)
+            instance_index = (
+                self._get_instance_index(cluster_id, include_terminated, terminated_after)
+                if include_instances else None
+            )
 
             for fleet in response['InstanceFleets']:
-                # Get EC2 instance IDs for this fleet
-                # For terminated clusters, get historical instances
-                if include_terminated:
-                    ec2_instances, instance_type_counts = self._get_historical_ec2_instances_for_fleet(
-                        cluster_id, fleet['Id']
-                    )
-                else:
-                    ec2_instances, instance_type_counts = self._get_ec2_instances_for_fleet(
-                        cluster_id, fleet['Id']
-                    )
+                # EC2 instances of this fleet (including historical ones, see _get_instance_index)
+                instances = instance_index.get(fleet['Id'], []) if instance_index is not None else []
+
+                # Track instance type counts (of the current instances, unless all have terminated)
+                instance_type_counts = {}
+                for instance in [i for i in instances if i['state'] != 'TERMINATED'] or instances:
+                    inst_type = instance['instance_type']
+                    instance_type_counts[inst_type] = instance_type_counts.get(inst_type, 0) + 1
 
                 # Determine the primary instance type (most common in the fleet)
                 primary_instance_type = self._get_primary_instance_type(
@@ -239,7 +306,7 @@ class EMRService:
                         'bid_price_as_percentage': spec.get('BidPriceAsPercentageOfOnDemandPrice')
                     })
 
-                instance_fleets.append({
+                fleet_info = {
                     'id': fleet['Id'],
                     'name': fleet.get('Name', fleet['InstanceFleetType']),
                     'type': fleet['InstanceFleetType'],  # MASTER, CORE, TASK
@@ -253,112 +320,72 @@ class EMRService:
                     'provisioned_spot': fleet.get('ProvisionedSpotCapacity', 0),
                     'market': 'MIXED' if fleet.get('TargetSpotCapacity', 0) > 0 else 'ON_DEMAND',
                     'state': fleet['Status']['State'],
-                    'ec2_instances': ec2_instances,
-                    'instance_type_counts': instance_type_counts,  # Count per instance type
                     'is_fleet': True
-                })
-        except Exception as e:
-            print(f"Error getting instance fleets for {cluster_id}: {e}")
-
-        return instance_fleets
-
-    def _get_ec2_instances_for_group(self, cluster_id: str, instance_group_id: str) -> List[str]:
-        """Get EC2 instance IDs for an instance group"""
-        ec2_instances = []
-
-        try:
-            paginator = self.emr_client.get_paginator('list_instances')
-            for page in paginator.paginate(
-                ClusterId=cluster_id,
-                InstanceGroupId=instance_group_id,
-                InstanceStates=['RUNNING']
-            ):
-                for instance in page['Instances']:
-                    if 'Ec2InstanceId' in instance:
-                        ec2_instances.append(instance['Ec2InstanceId'])
-        except Exception as e:
-            print(f"Error getting EC2 instances for group {instance_group_id}: {e}")
-
-        return ec2_instances
+                }
 
-    def _get_historical_ec2_instances_for_group(self, cluster_id: str, instance_group_id: str) -> List[str]:
-        """
-        Get EC2 instance IDs for a terminated cluster's instance group.
-        Includes terminated instances for historical analysis.
-        """
-        ec2_instances = []
+                if instance_index is not None:
+                    fleet_info['ec2_instances'] = [instance['ec2_instance_id'] for instance in instances]
+                    fleet_info['instances'] = instances  # Per-instance type, state, market and lifecycle times
+                    fleet_info['instance_type_counts'] = instance_type_counts  # Count per instance type
 
-        try:
-            paginator = self.emr_client.get_paginator('list_instances')
-            # Include TERMINATED state to get historical instances
-            for page in paginator.paginate(
-                ClusterId=cluster_id,
-                InstanceGroupId=instance_group_id,
-                InstanceStates=['RUNNING', 'TERMINATED']
-            ):
-                for instance in page['Instances']:
-                    if 'Ec2InstanceId' in instance:
-                        ec2_instances.append(instance['Ec2InstanceId'])
+                instance_fleets.append(fleet_info)
         except Exception as e:
-            print(f"Error getting historical EC2 instances for group {instance_group_id}: {e}")
-
-        return ec2_instances
-
-    def _get_ec2_instances_for_fleet(self, cluster_id: str, fleet_id: str) -> tuple:
-        """
-        Get EC2 instance IDs for an instance fleet.
-        Returns tuple of (list of instance IDs, dict of instance type counts)
-        """
-        ec2_instances = []
-        instance_type_counts = {}
-
-        try:
-            paginator = self.emr_client.get_paginator('list_instances')
-            for page in paginator.paginate(
-                ClusterId=cluster_id,
-                InstanceFleetId=fleet_id,
-                InstanceStates=['RUNNING']
-            ):
-                for instance in page['Instances']:
-                    if 'Ec2InstanceId' in instance:
-                        ec2_instances.append(instance['Ec2InstanceId'])
-
-                        # Track instance type counts
-                        inst_type = instance.get('InstanceType', 'unknown')
-                        instance_type_counts[inst_type] = instance_type_counts.get(inst_type, 0) + 1
-        except Exception as e:
-            print(f"Error getting EC2 instances for fleet {fleet_id}: {e}")
+            print(f"Error getting instance fleets for {cluster_id}: {e}")
 
-        return ec2_instances, instance_type_counts
+        return instance_fleets
 
-    def _get_historical_ec2_instances_for_fleet(self, cluster_id: str, fleet_id: str) -> tuple:
+    def _get_instance_index(
+        self,
+        cluster_id: str,
+        include_terminated: bool = False,
+        terminated_after: Optional[datetime] = None
+    ) -> Dict[str, List[Dict]]:
         """
-        Get EC2 instance IDs for a terminated cluster's instance fleet.
-        Includes terminated instances for historical analysis.
-        Returns tuple of (list of instance IDs, dict of instance type counts)
+        Get the cluster's EC2 instances with a single paginated list_instances sweep,
+        partitioned by instance group or fleet ID.
+        For terminated clusters, terminated instances are included for historical analysis.
+        For running clusters, instances terminated after terminated_after (e.g. scaled-in task
+        nodes) are included too, so an analysis covers every instance that ran in its window.
+        Returns dict of group/fleet ID -> list of instance details
         """
-        ec2_instances = []
-        instance_type_counts = {}
+        if terminated_after and terminated_after.tzinfo is None:
+            terminated_after = terminated_after.replace(tzinfo=timezone.utc)
+        list_terminated = include_terminated or terminated_after is not None
+        instance_states = ['RUNNING', 'TERMINATED'] if list_terminated else ['RUNNING']
+        index = {}
 
         try:
             paginator = self.emr_client.get_paginator('list_instances')
-            # Include TERMINATED state to get historical instances
-            for page in paginator.paginate(
-                ClusterId=cluster_id,
-                InstanceFleetId=fleet_id,
-                InstanceStates=['RUNNING', 'TERMINATED']
-            ):
+            for page in paginator.paginate(ClusterId=cluster_id, InstanceStates=instance_states):
                 for instance in page['Instances']:
-                    if 'Ec2InstanceId' in instance:
-                        ec2_instances.append(instance['Ec2InstanceId'])
-
-                        # Track instance type counts
-                        inst_type = instance.get('InstanceType', 'unknown')
-                        instance_type_counts[inst_type] = instance_type_counts.get(inst_type, 0) + 1
+                    if 'Ec2InstanceId' not in instance:
+                        continue
+
+                    group_id = instance.get('InstanceGroupId') or instance.get('InstanceFleetId')
+                    timeline = instance.get('Status', {}).get('Timeline', {})
+                    launched_at = timeline.get('CreationDateTime')
+                    terminated_at = timeline.get('EndDateTime')
+
+                    # Skip instances of a running cluster that terminated before the window
+                    if not include_terminated and terminated_at and terminated_after:
+                        if terminated_at.tzinfo is None:
+                            terminated_at = terminated_at.replace(tzinfo=timezone.utc)
+                        if terminated_at < terminated_after:
+                            continue
+
+                    index.setdefault(group_id, []).append({
+                        'ec2_instance_id': instance['Ec2InstanceId'],
+                        'instance_type': instance.get('InstanceType', 'unknown'),
+                        'state': instance.get('Status', {}).get('State'),
+                        'market': instance.get('Market'),
+                        'launched_at': launched_at.isoformat() if launched_at else None,
+                        'terminated_at': terminated_at.isoformat() if terminated_at else None
+                    })
         except Exception as e:
-            print(f"Error getting historical EC2 instances for fleet {fleet_id}: {e}")
+            print(f"Error getting EC2 instances for cluster {cluster_id}: {e}")
+            return {}
 
-        return ec2_instances, instance_type_counts
+        return index
 
     def _get_primary_instance_type(self, fleet: Dict, instance_type_counts: Dict) -> str:
         """
@@ -382,28 +409,16 @@ class EMRService:
 
         return 'unknown'
 
-    def get_cluster_by_id(self, cluster_id: str) -> Optional[Dict]:
-        """Get a specific cluster by ID"""
-        return self._get_cluster_details(cluster_id)
-
-    def get_instance_group_ec2_details(self, ec2_instance_ids: List[str]) -> List[Dict]:
-        """Get EC2 instance details for monitoring"""
-        if not ec2_instance_ids:
-            return []
-
-        ec2_details = []
-        try:
-            response = self.ec2_client.describe_instances(InstanceIds=ec2_instance_ids)
-            for reservation in response['Reservations']:
-                for instance in reservation['Instances']:
-                    ec2_details.append({
-                        'instance_id': instance['InstanceId'],
-                        'instance_type': instance['InstanceType'],
-                        'launch_time': instance['LaunchTime'].isoformat(),
-                        'private_ip': instance.get('PrivateIpAddress'),
-                        'state': instance['State']['Name']
-                    })
-        except Exception as e:
-            print(f"Error getting EC2 details: {e}")
+    def get_cluster_by_id(self, cluster_id: str, terminated_after: Optional[datetime] = None) -> Optional[Dict]:
+        """
+        Get a specific cluster by ID.
+        With terminated_after, instances of a running cluster terminated since then are included.
+        """
+        return self._get_cluster_details(cluster_id, terminated_after=terminated_after)
 
-        return ec2_details
+    def get_instance_group_ec2_details(self, ec2_instance_ids: List[str], refresh_state: bool = False) -> List[Dict]:
+        """
+        Get EC2 instance details for monitoring, described in batches (see EC2Service).
+        Instances described before keep their last known state unless refresh_state is set.
+        """
+        return self.ec2_service.get_instance_details(ec2_instance_ids, refresh_state)
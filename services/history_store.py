@@ -0,0 +1,182 @@
+"""
+Analysis history store backed by SQLite
+Analyses are stored one row each, indexed by cluster and time, with the latest analysis per cluster tracked separately
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+import config
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cluster_id TEXT NOT NULL,
+    analyzed_at TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_cluster_time ON analyses (cluster_id, analyzed_at);
+CREATE INDEX IF NOT EXISTS idx_analyses_time ON analyses (analyzed_at);
+CREATE TABLE IF NOT EXISTS latest_analyses (
+    cluster_id TEXT PRIMARY KEY,
+    analysis_id INTEGER NOT NULL REFERENCES analyses (id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS metadata (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class HistoryStore:
+    """Analysis history in a SQLite database (WAL mode, one connection per thread)"""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or config.ANALYSIS_HISTORY_DB
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+        self._local = threading.local()
+        self._write_lock = threading.Lock()  # One writer at a time within the process
+
+        with self._write_lock, self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+        self.import_json(config.ANALYSIS_HISTORY_FILE)
+        self.apply_retention()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=config.SQLITE_BUSY_TIMEOUT_SECONDS)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    def save(self, analysis: Dict):
+        """
+        Store an analysis, make it the cluster's latest unless a newer one is stored, and apply
+        the retention policy to the cluster
+        """
+        cluster_id = analysis['cluster_id']
+        with self._write_lock, self._connection() as conn:
+            cursor = conn.execute(
+                'INSERT INTO analyses (cluster_id, analyzed_at, payload) VALUES (?, ?, ?)',
+                (cluster_id, analysis['analyzed_at'], json.dumps(analysis, default=str))
+            )
+            self._update_latest(conn, cluster_id, cursor.lastrowid)
+            self._prune_cluster(conn, cluster_id)
+
+    def _update_latest(self, conn: sqlite3.Connection, cluster_id: str, analysis_id: int):
+        """
+        Point the cluster's latest analysis at analysis_id unless the current one was analyzed later
+        (ties go to the newer row, matching the retention order)
+        """
+        conn.execute(
+            'INSERT INTO latest_analyses (cluster_id, analysis_id) VALUES (?, ?) '
+            'ON CONFLICT (cluster_id) DO UPDATE SET analysis_id = excluded.analysis_id '
+            'WHERE (SELECT analyzed_at FROM analyses WHERE id = latest_analyses.analysis_id) <= '
+            '(SELECT analyzed_at FROM analyses WHERE id = excluded.analysis_id)',
+            (cluster_id, analysis_id)
+        )
+
+    def get_latest(self, cluster_id: str) -> Optional[Dict]:
+        """Get the most recent analysis for a cluster (one primary key lookup)"""
+        row = self._connection().execute(
+            'SELECT a.payload FROM latest_analyses l JOIN analyses a ON a.id = l.analysis_id '
+            'WHERE l.cluster_id = ?',
+            (cluster_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_history(self, cluster_id: str = None) -> Dict[str, List[Dict]]:
+        """Get stored analyses per cluster, oldest first, optionally for one cluster"""
+        if cluster_id:
+            rows = self._connection().execute(
+                'SELECT cluster_id, payload FROM analyses WHERE cluster_id = ? ORDER BY analyzed_at, id',
+                (cluster_id,)
+            )
+            history = {cluster_id: []}
+        else:
+            rows = self._connection().execute(
+                'SELECT cluster_id, payload FROM analyses ORDER BY cluster_id, analyzed_at, id'
+            )
+            history = {}
+
+        for row_cluster_id, payload in rows:
+            history.setdefault(row_cluster_id, []).append(json.loads(payload))
+        return history
+
+    def apply_retention(self):
+        """
+        Drop analyses older than ANALYSIS_HISTORY_MAX_AGE_DAYS and beyond the newest
+        ANALYSIS_HISTORY_MAX_PER_CLUSTER per cluster (0 disables either limit)
+        """
+        with self._write_lock, self._connection() as conn:
+            if config.ANALYSIS_HISTORY_MAX_AGE_DAYS > 0:
+                cutoff = datetime.now(timezone.utc) - timedelta(days=config.ANALYSIS_HISTORY_MAX_AGE_DAYS)
+                conn.execute('DELETE FROM analyses WHERE analyzed_at < ?', (cutoff.isoformat(),))
+
+            if config.ANALYSIS_HISTORY_MAX_PER_CLUSTER > 0:
+                cluster_ids = [row[0] for row in conn.execute('SELECT DISTINCT cluster_id FROM analyses')]
+                for cluster_id in cluster_ids:
+                    self._prune_cluster(conn, cluster_id)
+
+    def _prune_cluster(self, conn: sqlite3.Connection, cluster_id: str):
+        """Apply the retention policy to one cluster inside the caller's transaction"""
+        if config.ANALYSIS_HISTORY_MAX_AGE_DAYS > 0:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=config.ANALYSIS_HISTORY_MAX_AGE_DAYS)
+            conn.execute(
+                'DELETE FROM analyses WHERE cluster_id = ? AND analyzed_at < ?',
+                (cluster_id, cutoff.isoformat())
+            )
+
+        if config.ANALYSIS_HISTORY_MAX_PER_CLUSTER > 0:
+            conn.execute(
+                'DELETE FROM analyses WHERE cluster_id = ? AND id NOT IN ('
+                'SELECT id FROM analyses WHERE cluster_id = ? ORDER BY analyzed_at DESC, id DESC LIMIT ?)',
+                (cluster_id, cluster_id, config.ANALYSIS_HISTORY_MAX_PER_CLUSTER)
+            )
+
+    def import_json(self, json_path: str) -> int:
+        """
+        Import analyses from the legacy JSON history file, once per database.
+        The file is left in place. Returns the number of analyses imported.
+        """
+        if not json_path or not os.path.exists(json_path):
+            return 0
+
+        with self._write_lock, self._connection() as conn:
+            if conn.execute("SELECT 1 FROM metadata WHERE key = 'json_imported_from'").fetchone():
+                return 0
+
+            try:
+                with open(json_path, 'r') as f:
+                    history = json.load(f)
+            except Exception as e:
+                print(f"Error importing analysis history from {json_path}: {e}")
+                return 0
+
+            imported = 0
+            for cluster_id, analyses in history.items():
+                # Oldest first, so the latest pointer ends on the newest analysis (or one already stored)
+                for analysis in sorted(analyses, key=lambda a: a.get('analyzed_at', '')):
+                    cursor = conn.execute(
+                        'INSERT INTO analyses (cluster_id, analyzed_at, payload) VALUES (?, ?, ?)',
+                        (cluster_id, analysis.get('analyzed_at', ''), json.dumps(analysis, default=str))
+                    )
+                    self._update_latest(conn, cluster_id, cursor.lastrowid)
+                    imported += 1
+
+            conn.execute(
+                "INSERT INTO metadata (key, value) VALUES ('json_imported_from', ?)",
+                (json_path,)
+            )
+
+        print(f"Imported {imported} analyses from {json_path}")
+        return imported
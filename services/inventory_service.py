@@ -0,0 +1,263 @@
+"""
+Inventory Service: in-memory snapshot of EMR clusters with incremental refresh
+Discovers every configured target (account/region) concurrently
+"""
+import atexit
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import config
+from services.aws_client import get_targets
+from services.emr_service import EMRService
+
+
+class InventoryService:
+    """Keeps running and recently terminated clusters in memory and refreshes them incrementally"""
+
+    def __init__(self, emr_services: List[EMRService] = None):
+        # One EMRService per discovery target, keyed by target name
+        emr_services = emr_services or [EMRService(target) for target in get_targets()]
+        self.emr_services: Dict[str, EMRService] = {service.target['name']: service for service in emr_services}
+
+        # target name -> cluster id -> cluster summary, in listing order
+        self._clusters: Dict[str, Dict[str, Dict]] = {name: {} for name in self.emr_services}
+        self._details: Dict[str, tuple] = {}  # cluster id -> (fetched at, full cluster details)
+        self._synced_at: Optional[datetime] = None
+        self._synced_monotonic: Optional[float] = None
+        self._last_full_refresh: Dict[str, float] = {name: 0.0 for name in self.emr_services}
+        self._refreshing = set()  # Targets whose refresh is still running
+        self._lock = threading.Lock()  # Guards the snapshot
+        self._refresh_lock = threading.Lock()  # One refresh at a time
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.emr_services),
+            thread_name_prefix='inventory-target'
+        )
+        self._poller: Optional[threading.Thread] = None
+        self._stop_polling = threading.Event()
+
+    def get_clusters(self, force_refresh: bool = False) -> Dict:
+        """
+        Get the cluster snapshot, refreshing it first if it is older than INVENTORY_MAX_AGE_SECONDS.
+        If a refresh fails, the previous snapshot is served.
+        Returns dict with running and terminated cluster lists, sync time and snapshot age.
+        Runtimes are as of each cluster's last describe (at most INVENTORY_FULL_REFRESH_SECONDS old),
+        so the snapshot only changes when clusters do.
+        """
+        try:
+            self.refresh(max_age_seconds=None if force_refresh else config.INVENTORY_MAX_AGE_SECONDS)
+        except Exception as e:
+            if self._synced_at is None:
+                raise
+            print(f"Error refreshing cluster inventory, serving previous snapshot: {e}")
+
+        with self._lock:
+            clusters = [c for target_clusters in self._clusters.values() for c in target_clusters.values()]
+            synced_at = self._synced_at
+
+        return {
+            'running': [c for c in clusters if not c['is_terminated']],
+            'terminated': [c for c in clusters if c['is_terminated']],
+            'synced_at': synced_at.isoformat() if synced_at else None,
+            'age_seconds': self.age_seconds()
+        }
+
+    def age_seconds(self) -> Optional[float]:
+        """Seconds since the last successful refresh (None before the first one)"""
+        if self._synced_monotonic is None:
+            return None
+        return round(time.monotonic() - self._synced_monotonic, 1)
+
+    def refresh(self, max_age_seconds: Optional[float] = None, full: bool = False):
+        """
+        Refresh every target concurrently, waiting up to AWS_TARGET_TIMEOUT_SECONDS.
+        Targets that take longer keep serving their previous snapshot until their refresh
+        completes in the background. Raises if every target failed.
+        Skipped if the snapshot is younger than max_age_seconds.
+        """
+        with self._refresh_lock:
+            # Another request may have refreshed the snapshot while this one waited
+            age = self.age_seconds()
+            if max_age_seconds is not None and age is not None and age <= max_age_seconds:
+                return
+
+            futures = []
+            for target_name in self.emr_services:
+                with self._lock:
+                    # A slow target from an earlier cycle is not refreshed twice at once
+                    if target_name in self._refreshing:
+                        continue
+                    self._refreshing.add(target_name)
+                futures.append(self._executor.submit(self._refresh_target, target_name, full))
+
+            done, not_done = wait(futures, timeout=config.AWS_TARGET_TIMEOUT_SECONDS)
+            errors = [future.exception() for future in done if future.exception()]
+
+            if not_done:
+                print(f"Cluster inventory: {len(not_done)} target(s) still refreshing, serving their previous snapshot")
+            if futures and len(errors) == len(futures):
+                raise errors[0]
+
+            if len(done) > len(errors):
+                with self._lock:
+                    self._synced_at = datetime.now(timezone.utc)
+                    self._synced_monotonic = time.monotonic()
+
+    def _refresh_target(self, target_name: str, full: bool = False):
+        """
+        Refresh one target's part of the snapshot.
+        Lists running and recently terminated clusters, describes only clusters that are new or
+        whose state changed, and drops clusters that are no longer listed (terminated more than
+        TERMINATED_CLUSTER_WINDOW_HOURS ago). Every INVENTORY_FULL_REFRESH_SECONDS all clusters
+        are described again so resizes are picked up.
+        """
+        try:
+            emr_service = self.emr_services[target_name]
+            started = time.monotonic()
+            full = full or started - self._last_full_refresh[target_name] >= config.INVENTORY_FULL_REFRESH_SECONDS
+
+            running = emr_service.list_running_cluster_summaries()
+            terminated = emr_service.list_recently_terminated_cluster_summaries(
+                config.TERMINATED_CLUSTER_WINDOW_HOURS
+            )
+
+            with self._lock:
+                known = dict(self._clusters[target_name])
+
+            def needs_describe(summary: Dict) -> bool:
+                cluster = known.get(summary['Id'])
+                return full or cluster is None or cluster['state'] != summary['Status']['State']
+
+            described = {}
+            for summaries, include_terminated in ((running, False), (terminated, True)):
+                cluster_ids = [summary['Id'] for summary in summaries if needs_describe(summary)]
+                # Listing only needs the summary projection; instances are listed on demand
+                for cluster_info in emr_service.hydrate_clusters(
+                    cluster_ids, include_terminated, include_instances=False
+                ):
+                    described[cluster_info['id']] = cluster_info
+
+            clusters = {}
+            for summary in running + terminated:
+                cluster_id = summary['Id']
+                # Clusters that failed to load keep their previous details until the next refresh
+                cluster_info = described.get(cluster_id) or known.get(cluster_id)
+                if cluster_info:
+                    clusters[cluster_id] = cluster_info
+
+            with self._lock:
+                self._clusters[target_name] = clusters
+                # Drop full details of clusters that left the snapshot or changed state
+                states = {
+                    cluster_id: cluster['state']
+                    for target_clusters in self._clusters.values()
+                    for cluster_id, cluster in target_clusters.items()
+                }
+                self._details = {
+                    cluster_id: (fetched_at, details)
+                    for cluster_id, (fetched_at, details) in self._details.items()
+                    if states.get(cluster_id) == details['state']
+                }
+                if full:
+                    self._last_full_refresh[target_name] = started
+        except Exception as e:
+            print(f"Error refreshing cluster inventory for {target_name}: {e}")
+            raise
+        finally:
+            with self._lock:
+                self._refreshing.discard(target_name)
+
+    def find_clusters(
+        self,
+        cluster_types: Optional[List[str]] = None,
+        states: Optional[List[str]] = None,
+        tags: Optional[Dict[str, str]] = None
+    ) -> List[Dict]:
+        """
+        Get snapshot clusters matching every given filter: cluster type (TRANSIENT, LONG_RUNNING),
+        EMR state (e.g. WAITING, RUNNING, TERMINATED) and tag values. None matches everything.
+        """
+        inventory = self.get_clusters()
+        return [
+            cluster for cluster in inventory['running'] + inventory['terminated']
+            if (not cluster_types or cluster['cluster_type'] in cluster_types)
+            and (not states or cluster['state'] in states)
+            and all(cluster.get('tags', {}).get(key) == value for key, value in (tags or {}).items())
+        ]
+
+    def get_cluster(self, cluster_id: str) -> Optional[Dict]:
+        """
+        Get full details (including instances) of a cluster.
+        Details of clusters in the snapshot are reused for up to INVENTORY_MAX_AGE_SECONDS
+        while their state is unchanged; other clusters are looked up in each target in turn.
+        """
+        with self._lock:
+            target_name = self._find_target_name(cluster_id)
+            cached = self._details.get(cluster_id)
+
+        if cached and time.monotonic() - cached[0] <= config.INVENTORY_MAX_AGE_SECONDS:
+            return cached[1]
+
+        if target_name:
+            details = self.emr_services[target_name].get_cluster_by_id(cluster_id)
+            if details:
+                with self._lock:
+                    self._details[cluster_id] = (time.monotonic(), details)
+            return details
+
+        for emr_service in self.emr_services.values():
+            details = emr_service.get_cluster_by_id(cluster_id)
+            if details:
+                return details
+        return None
+
+    def find_target(self, cluster_id: str) -> Optional[Dict]:
+        """Get the target (account/region) a cluster belongs to, or None if no target has it"""
+        with self._lock:
+            target_name = self._find_target_name(cluster_id)
+
+        if not target_name:
+            details = self.get_cluster(cluster_id)
+            target_name = details['target'] if details else None
+
+        return self.emr_services[target_name].target if target_name else None
+
+    def _find_target_name(self, cluster_id: str) -> Optional[str]:
+        """Name of the target whose snapshot holds the cluster; the caller holds _lock"""
+        for target_name, clusters in self._clusters.items():
+            if cluster_id in clusters:
+                return target_name
+        return None
+
+    def start_poller(self, interval_seconds: float):
+        """
+        Start a background thread that refreshes the snapshot every interval_seconds (idempotent).
+        The poller is stopped when the interpreter exits.
+        """
+        with self._lock:
+            if self._poller is not None:
+                return
+            self._poller = threading.Thread(
+                target=self._poll,
+                args=(interval_seconds,),
+                name='inventory-poller',
+                daemon=True
+            )
+            self._poller.start()
+            atexit.register(self.stop_poller)
+
+    def stop_poller(self):
+        """Stop the background poller"""
+        self._stop_polling.set()
+
+    def _poll(self, interval_seconds: float):
+        """Poller loop: refresh, then wait for the next interval"""
+        while not self._stop_polling.is_set():
+            try:
+                # Skip the cycle if a request refreshed the snapshot in the meantime
+                self.refresh(max_age_seconds=interval_seconds / 2)
+            except Exception as e:
+                print(f"Error polling cluster inventory: {e}")
+            self._stop_polling.wait(interval_seconds)
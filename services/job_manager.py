@@ -0,0 +1,110 @@
+"""
+Background jobs for long-running work (cluster analyses)
+Jobs run on a shared worker pool; identical requests attach to the job already in flight
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Hashable, Optional
+import config
+
+
+class JobManager:
+    """Runs jobs on a background pool and keeps their status and results for polling"""
+
+    def __init__(self, max_workers: int = None):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or config.JOB_MAX_WORKERS,
+            thread_name_prefix='job-worker'
+        )
+        self._jobs: Dict[str, Dict] = {}  # job id -> job
+        self._in_flight: Dict[Hashable, str] = {}  # job key -> id of its queued or running job
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, func: Callable, *args, **kwargs) -> tuple:
+        """
+        Run func(*args, **kwargs) as a job, unless a job with the same key is queued or running,
+        in which case that job is returned instead (single flight).
+        func returns the job result; a dict with an 'error' key, or an exception, fails the job.
+        Returns tuple of (job, True if a new job was started)
+        """
+        with self._lock:
+            self._prune()
+
+            job_id = self._in_flight.get(key)
+            if job_id:
+                return self._public(self._jobs[job_id]), False
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'key': key,
+                'status': 'queued',
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                '_finished_monotonic': None
+            }
+            self._jobs[job['id']] = job
+            self._in_flight[key] = job['id']
+
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return self._public(job), True
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Get a job's status (and result or error once finished), or None if unknown or expired"""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            return self._public(job) if job else None
+
+    def _run(self, job: Dict, func: Callable, args: tuple, kwargs: Dict):
+        """Worker: run the job function and record its outcome"""
+        with self._lock:
+            job['status'] = 'running'
+            job['started_at'] = datetime.now(timezone.utc).isoformat()
+
+        result, error = None, None
+        try:
+            result = func(*args, **kwargs)
+            if isinstance(result, dict) and 'error' in result:
+                result, error = None, result['error']
+        except Exception as e:
+            print(f"Error running job {job['id']}: {e}")
+            error = str(e)
+
+        with self._lock:
+            job['status'] = 'failed' if error else 'succeeded'
+            job['result'] = result
+            job['error'] = error
+            job['finished_at'] = datetime.now(timezone.utc).isoformat()
+            job['_finished_monotonic'] = time.monotonic()
+            # New requests with the same key start a fresh job from now on
+            if self._in_flight.get(job['key']) == job['id']:
+                del self._in_flight[job['key']]
+
+    def _prune(self):
+        """Drop finished jobs older than JOB_RESULT_TTL_SECONDS; the caller holds _lock"""
+        cutoff = time.monotonic() - config.JOB_RESULT_TTL_SECONDS
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['_finished_monotonic'] is not None and job['_finished_monotonic'] < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _public(job: Dict) -> Dict:
+        """Job fields returned to API clients"""
+        return {
+            'id': job['id'],
+            'status': job['status'],
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at'],
+            'result': job['result'],
+            'error': job['error']
+        }
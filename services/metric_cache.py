@@ -0,0 +1,228 @@
+"""
+Persistent cache of CloudWatch datapoints for metric collection
+Each series is keyed by (instance_id, namespace, metric, period) and aligned to period buckets
+"""
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Dict, Tuple
+import config
+
+
+class MetricCache:
+    """On-disk datapoint cache that tracks which time ranges have already been fetched"""
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir or config.METRIC_CACHE_DIR
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._last_eviction = 0
+
+    def get_missing_ranges(
+        self,
+        key: Tuple,
+        start_time: datetime,
+        end_time: datetime
+    ) -> List[Tuple[datetime, datetime]]:
+        """
+        Get the parts of [start_time, end_time) that are not covered by the cache.
+        Ranges are aligned to the series period.
+        """
+        period = key[3]
+        start, end = self._align(start_time, period), self._align_up(end_time, period)
+        if start >= end:
+            return []
+
+        with self._lock:
+            covered = self._load(key)['covered']
+
+        missing = []
+        cursor = start
+        for covered_start, covered_end in covered:
+            if covered_end <= cursor:
+                continue
+            if covered_start >= end:
+                break
+            if covered_start > cursor:
+                missing.append((cursor, covered_start))
+            cursor = max(cursor, covered_end)
+        if cursor < end:
+            missing.append((cursor, end))
+
+        return [(self._to_datetime(s), self._to_datetime(e)) for s, e in missing]
+
+    def get_datapoints(self, key: Tuple, start_time: datetime, end_time: datetime) -> List[Dict]:
+        """Get cached datapoints for the period buckets overlapping [start_time, end_time)"""
+        period = key[3]
+        start, end = self._align(start_time, period), self._align_up(end_time, period)
+
+        with self._lock:
+            entry = self._load(key, touch=True)
+
+        datapoints = []
+        for timestamp in sorted(int(ts) for ts in entry['datapoints']):
+            if start <= timestamp < end:
+                values = entry['datapoints'][str(timestamp)]
+                datapoint = {'Timestamp': self._to_datetime(timestamp)}
+                for statistic, value in zip(('Average', 'Maximum', 'Minimum'), values):
+                    if value is not None:
+                        datapoint[statistic] = value
+                datapoints.append(datapoint)
+
+        return datapoints
+
+    def store(
+        self,
+        key: Tuple,
+        start_time: datetime,
+        end_time: datetime,
+        datapoints: List[Dict]
+    ):
+        """
+        Store datapoints fetched for [start_time, end_time).
+        Only the settled part of the range (older than METRIC_CACHE_SETTLE_SECONDS)
+        is marked as covered, so recent buckets that CloudWatch may still fill in are refetched.
+        """
+        period = key[3]
+        settled_end = self._align(
+            datetime.fromtimestamp(time.time() - config.METRIC_CACHE_SETTLE_SECONDS, timezone.utc),
+            period
+        )
+        start = self._align(start_time, period)
+        end = min(self._align_up(end_time, period), settled_end)
+
+        with self._lock:
+            entry = self._load(key)
+            for dp in datapoints:
+                timestamp = str(int(dp['Timestamp'].timestamp()))
+                entry['datapoints'][timestamp] = [dp.get('Average'), dp.get('Maximum'), dp.get('Minimum')]
+            if start < end:
+                entry['covered'] = self._merge_ranges(entry['covered'] + [[start, end]])
+            self._save(key, entry)
+
+        self.evict_if_due()
+
+    def evict_if_due(self):
+        """Run eviction at most once per METRIC_CACHE_EVICTION_INTERVAL_SECONDS"""
+        now = time.time()
+        if now - self._last_eviction < config.METRIC_CACHE_EVICTION_INTERVAL_SECONDS:
+            return
+        self._last_eviction = now
+        self.evict()
+
+    def evict(self):
+        """
+        Drop datapoints older than METRIC_CACHE_MAX_AGE_DAYS, then remove the least recently
+        used series until the cache is under METRIC_CACHE_MAX_BYTES.
+        """
+        cutoff = int(time.time() - config.METRIC_CACHE_MAX_AGE_DAYS * 86400)
+
+        with self._lock:
+            files = []
+            for filename in os.listdir(self.cache_dir):
+                if not filename.endswith('.json'):
+                    continue
+                path = os.path.join(self.cache_dir, filename)
+                try:
+                    # Series not read or written within the age limit are dropped entirely
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        continue
+                    self._trim_file(path, cutoff)
+                    files.append((os.path.getmtime(path), os.path.getsize(path), path))
+                except Exception as e:
+                    print(f"Error evicting metric cache file {filename}: {e}")
+
+            total_bytes = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total_bytes <= config.METRIC_CACHE_MAX_BYTES:
+                    break
+                try:
+                    os.remove(path)
+                    total_bytes -= size
+                except Exception as e:
+                    print(f"Error evicting metric cache file {path}: {e}")
+
+    def _trim_file(self, path: str, cutoff: int):
+        """Remove datapoints and coverage older than cutoff from a cache file"""
+        with open(path, 'r') as f:
+            entry = json.load(f)
+
+        stale = [ts for ts in entry['datapoints'] if int(ts) < cutoff]
+        if not stale and all(start >= cutoff for start, _ in entry['covered']):
+            return
+
+        mtime = os.path.getmtime(path)
+        for ts in stale:
+            del entry['datapoints'][ts]
+        entry['covered'] = [[max(start, cutoff), end] for start, end in entry['covered'] if end > cutoff]
+        self._write(path, entry)
+        # Keep the last-used time so size eviction stays LRU
+        os.utime(path, (mtime, mtime))
+
+    def _load(self, key: Tuple, touch: bool = False) -> Dict:
+        """Load a series entry, returning an empty entry if missing or unreadable"""
+        path = self._path(key)
+        try:
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    entry = json.load(f)
+                if touch:
+                    os.utime(path)
+                return entry
+        except Exception as e:
+            print(f"Error loading metric cache for {key}: {e}")
+        return {'key': list(key), 'covered': [], 'datapoints': {}}
+
+    def _save(self, key: Tuple, entry: Dict):
+        """Save a series entry"""
+        try:
+            self._write(self._path(key), entry)
+        except Exception as e:
+            print(f"Error saving metric cache for {key}: {e}")
+
+    def _write(self, path: str, entry: Dict):
+        """Write a cache file atomically"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def _path(self, key: Tuple) -> str:
+        """Get the cache file path for a series key"""
+        name = '__'.join(str(part) for part in key)
+        return os.path.join(self.cache_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', name) + '.json')
+
+    @staticmethod
+    def _merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+        """Merge overlapping or adjacent [start, end) ranges"""
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    @staticmethod
+    def _align(value: datetime, period: int) -> int:
+        """Round a datetime down to the start of its period bucket (epoch seconds)"""
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        epoch = int(value.timestamp())
+        return epoch - epoch % period
+
+    @classmethod
+    def _align_up(cls, value: datetime, period: int) -> int:
+        """Round a datetime up to the end of its period bucket (epoch seconds)"""
+        start = cls._align(value, period)
+        return start if start == int(value.timestamp()) else start + period
+
+    @staticmethod
+    def _to_datetime(epoch: int) -> datetime:
+        """Convert epoch seconds to a timezone-aware datetime"""
+        return datetime.fromtimestamp(epoch, timezone.utc)
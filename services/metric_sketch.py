@@ -0,0 +1,163 @@
+"""
+Mergeable metric summaries
+A MetricSketch holds count, sum, min, max, threshold counts and a log-bucketed quantile sketch
+(DDSketch-style: every quantile is within METRIC_ROLLUP_RELATIVE_ACCURACY of the datapoint at its rank)
+"""
+import math
+from typing import Dict, Iterable, List, Optional
+import config
+
+
+class MetricSketch:
+    """Mergeable summary of utilization datapoints (percent values)"""
+
+    # Values at or below this are counted in the zero bucket
+    MIN_INDEXABLE_VALUE = 1e-3
+
+    def __init__(self, relative_accuracy: float = None):
+        self.relative_accuracy = relative_accuracy or config.METRIC_ROLLUP_RELATIVE_ACCURACY
+        self._gamma = (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.max_average: Optional[float] = None  # Bounds the quantile estimates
+        self.zero_count = 0
+        self.buckets: Dict[int, int] = {}  # bucket index -> count
+        self.threshold_counts: Dict[str, int] = {str(t): 0 for t in config.UTILIZATION_THRESHOLDS}
+
+    def add(self, average: float, maximum: float = None, minimum: float = None):
+        """Add one datapoint: its average goes into the sketch, its maximum/minimum into max/min"""
+        self.count += 1
+        self.sum += average
+        self.max = max(v for v in (self.max, average, maximum) if v is not None)
+        self.min = min(v for v in (self.min, average, minimum) if v is not None)
+        self.max_average = average if self.max_average is None else max(self.max_average, average)
+
+        if average <= self.MIN_INDEXABLE_VALUE:
+            self.zero_count += 1
+        else:
+            index = self._index(average)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+
+        for threshold in self.threshold_counts:
+            if average >= float(threshold):
+                self.threshold_counts[threshold] += 1
+
+    def add_datapoints(self, datapoints: Iterable[Dict], avg_stat: str = 'Average'):
+        """Add CloudWatch datapoints (datapoints without avg_stat are skipped)"""
+        for dp in datapoints:
+            if dp.get(avg_stat) is not None:
+                self.add(dp[avg_stat], dp.get('Maximum'), dp.get('Minimum'))
+
+    def merge(self, other: 'MetricSketch'):
+        """
+        Merge another sketch into this one. Both must share a relative accuracy (their buckets cover
+        different ranges otherwise); only thresholds counted by both stay exact.
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError(
+                f"Cannot merge sketches with relative accuracy {other.relative_accuracy} "
+                f"into {self.relative_accuracy}"
+            )
+        if not other.count:
+            return
+        # Sketches built under other UTILIZATION_THRESHOLDS lack some counts; those are estimated
+        if self.count:
+            self.threshold_counts = {
+                threshold: count + other.threshold_counts[threshold]
+                for threshold, count in self.threshold_counts.items()
+                if threshold in other.threshold_counts
+            }
+        else:
+            self.threshold_counts = dict(other.threshold_counts)
+        self.count += other.count
+        self.sum += other.sum
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max_average = other.max_average if self.max_average is None else max(self.max_average, other.max_average)
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    @classmethod
+    def merged(cls, sketches: Iterable['MetricSketch']) -> 'MetricSketch':
+        """Merge sketches into a new sketch with their relative accuracy"""
+        sketches = list(sketches)
+        result = cls(sketches[0].relative_accuracy if sketches else None)
+        for sketch in sketches:
+            result.merge(sketch)
+        return result
+
+    def quantiles(self, quantiles: List[float]) -> List[Optional[float]]:
+        """Estimate quantiles (0-1) in one pass over the buckets"""
+        if not self.count:
+            return [None for _ in quantiles]
+
+        # Walk buckets in value order, answering each quantile with the representative value of the
+        # bucket holding the datapoint at its rank: 2 * gamma^i / (gamma + 1) is within the relative
+        # accuracy of every value in bucket i's (gamma^(i-1), gamma^i] range
+        ranks = sorted((q * (self.count - 1), position) for position, q in enumerate(quantiles))
+        buckets = [(0.0, self.zero_count)] + [
+            (2 * self._gamma ** index / (self._gamma + 1), self.buckets[index]) for index in sorted(self.buckets)
+        ]
+        results = [self.max_average] * len(quantiles)
+
+        answered = 0
+        cumulative = 0
+        for value, count in buckets:
+            while answered < len(ranks) and ranks[answered][0] < cumulative + count:
+                results[ranks[answered][1]] = min(value, self.max_average)
+                answered += 1
+            cumulative += count
+
+        return results
+
+    def count_at_or_above(self, value: float) -> float:
+        """
+        Number of datapoints >= value (exact for UTILIZATION_THRESHOLDS every merged sketch counted,
+        estimated otherwise)
+        """
+        if str(value) in self.threshold_counts:
+            return self.threshold_counts[str(value)]
+        if value <= self.MIN_INDEXABLE_VALUE:
+            return self.count
+        # Buckets above the value count fully; the value's own bucket by the share of its range above the value
+        lowest = self._index(value)
+        upper, lower = self._gamma ** lowest, self._gamma ** (lowest - 1)
+        partial = self.buckets.get(lowest, 0) * (upper - value) / (upper - lower)
+        return sum(count for index, count in self.buckets.items() if index > lowest) + partial
+
+    def to_dict(self) -> Dict:
+        """Serializable form (see from_dict)"""
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'max_average': self.max_average,
+            'zero_count': self.zero_count,
+            'buckets': {str(index): count for index, count in self.buckets.items()},
+            'threshold_counts': self.threshold_counts
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'MetricSketch':
+        """Rebuild a sketch from to_dict output"""
+        sketch = cls(data['relative_accuracy'])
+        sketch.count = data['count']
+        sketch.sum = data['sum']
+        sketch.min = data['min']
+        sketch.max = data['max']
+        sketch.max_average = data['max_average']
+        sketch.zero_count = data['zero_count']
+        sketch.buckets = {int(index): count for index, count in data['buckets'].items()}
+        sketch.threshold_counts = dict(data['threshold_counts'])
+        return sketch
+
+    def _index(self, value: float) -> int:
+        """Bucket index of a positive value"""
+        return math.ceil(math.log(value) / self._log_gamma)
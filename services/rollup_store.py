@@ -0,0 +1,116 @@
+"""
+Persistent hourly metric rollups backed by SQLite
+One MetricSketch per (instance_id, namespace, metric, period) series and hour
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Tuple
+import config
+from services.metric_sketch import MetricSketch
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    series TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    sketch TEXT NOT NULL,
+    PRIMARY KEY (series, hour)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_rollups_hour ON rollups (hour);
+"""
+
+# Series looked up per query (bound parameters stay well under SQLite's limit)
+MAX_SERIES_PER_QUERY = 500
+
+
+class RollupStore:
+    """Hourly MetricSketch rollups in a SQLite database (WAL mode, one connection per thread)"""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or config.METRIC_ROLLUP_DB
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+        self._local = threading.local()
+        self._write_lock = threading.Lock()  # One writer at a time within the process
+        self._last_eviction = 0
+
+        with self._write_lock, self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=config.SQLITE_BUSY_TIMEOUT_SECONDS)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, hours_by_key: Dict[Tuple, List[int]]) -> Dict[Tuple, Dict[int, MetricSketch]]:
+        """
+        Get the stored sketches of many series, each for its hours (epoch seconds); missing hours are left out.
+        Series are looked up MAX_SERIES_PER_QUERY at a time, each returned as one JSON array of its
+        [hour, sketch] rows, so a lookup costs one query per chunk and one JSON decode per series.
+        """
+        keys_by_series = {self._series(key): key for key, hours in hours_by_key.items() if hours}
+        series_names = list(keys_by_series)
+        stored = {key: {} for key in hours_by_key}
+
+        conn = self._connection()
+        for chunk_start in range(0, len(series_names), MAX_SERIES_PER_QUERY):
+            chunk = series_names[chunk_start:chunk_start + MAX_SERIES_PER_QUERY]
+            chunk_hours = [hour for series in chunk for hour in hours_by_key[keys_by_series[series]]]
+            rows = conn.execute(
+                "SELECT series, '[' || group_concat('[' || hour || ',' || sketch || ']') || ']' FROM rollups "
+                f"WHERE series IN ({','.join('?' * len(chunk))}) AND hour >= ? AND hour <= ? GROUP BY series",
+                (*chunk, min(chunk_hours), max(chunk_hours))
+            )
+            for series, series_rows in rows:
+                key = keys_by_series[series]
+                wanted = set(hours_by_key[key])
+                stored[key] = {
+                    hour: MetricSketch.from_dict(sketch)
+                    for hour, sketch in json.loads(series_rows)
+                    if hour in wanted
+                }
+
+        return stored
+
+    def store(self, rollups: List[Tuple[Tuple, int, MetricSketch]]):
+        """Store (series key, hour, sketch) rollups in one transaction"""
+        if not rollups:
+            return
+
+        with self._write_lock, self._connection() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO rollups (series, hour, sketch) VALUES (?, ?, ?)',
+                [
+                    (self._series(key), hour, json.dumps(sketch.to_dict(), separators=(',', ':')))
+                    for key, hour, sketch in rollups
+                ]
+            )
+
+        self.evict_if_due()
+
+    def evict_if_due(self):
+        """Drop rollups older than METRIC_ROLLUP_MAX_AGE_DAYS, at most once per eviction interval"""
+        now = time.time()
+        if now - self._last_eviction < config.METRIC_ROLLUP_EVICTION_INTERVAL_SECONDS:
+            return
+        self._last_eviction = now
+
+        cutoff = int(now - config.METRIC_ROLLUP_MAX_AGE_DAYS * 86400)
+        try:
+            with self._write_lock, self._connection() as conn:
+                conn.execute('DELETE FROM rollups WHERE hour < ?', (cutoff,))
+        except Exception as e:
+            print(f"Error evicting metric rollups: {e}")
+
+    @staticmethod
+    def _series(key: Tuple) -> str:
+        """Series column value for a (instance_id, namespace, metric, period) key"""
+        return '|'.join(str(part) for part in key)
@@ -8,6 +8,13 @@ let analysisModal = null;
 let totalPotentialSavings = 0;
 let lookbackOptions = [];
 let defaultLookbackHours = 72;
+let clustersEtag = null;
+
+// How often the cluster list is re-checked (unchanged lists cost a 304 and no re-render)
+const CLUSTER_POLL_INTERVAL_MS = 30000;
+
+// How often a running analysis job is polled
+const JOB_POLL_INTERVAL_MS = 1000;
 
 // Initialize on page load
 document.addEventListener('DOMContentLoaded', async () => {
@@ -18,6 +25,7 @@ document.addEventListener('DOMContentLoaded', async () => {
 
     // Load clusters
     refreshClusters();
+    setInterval(() => refreshClusters(true), CLUSTER_POLL_INTERVAL_MS);
 });
 
 /**
@@ -48,25 +56,41 @@ async function loadLookbackOptions() {
 }
 
 /**
- * Refresh clusters list
+ * Refresh clusters list.
+ * Background polls (silent) send the last ETag and skip re-rendering when the list is unchanged.
  */
-async function refreshClusters() {
-    showLoading();
-    hideError();
+async function refreshClusters(silent = false) {
+    if (!silent) {
+        showLoading();
+        hideError();
+    }
 
     try {
-        const response = await fetch('/api/clusters');
+        const headers = {};
+        if (silent && clustersEtag) {
+            headers['If-None-Match'] = clustersEtag;
+        }
+        const response = await fetch('/api/clusters', { headers, cache: 'no-store' });
+
+        // Not modified since the last render
+        if (response.status === 304) {
+            return;
+        }
+
         const result = await response.json();
 
         if (result.success) {
+            clustersEtag = response.headers.get('ETag');
             clustersData = result.data;
             renderClusters();
             updateSummary();
-        } else {
+        } else if (!silent) {
             showError(result.error || 'Failed to load clusters');
         }
     } catch (error) {
-        showError('Failed to connect to server: ' + error.message);
+        if (!silent) {
+            showError('Failed to connect to server: ' + error.message);
+        }
     }
 }
 
@@ -189,6 +213,11 @@ function createClusterCard(cluster, isTerminated = false) {
                             <i class="bi bi-tag"></i>
                             ${cluster.release_label}
                         </span>
+                        ${cluster.region ? `
+                        <span class="cluster-meta-item">
+                            <i class="bi bi-globe"></i>
+                            ${cluster.region}${cluster.account_id ? ` (${cluster.account_id})` : ''}
+                        </span>` : ''}
                         <span class="cluster-meta-item">
                             <i class="bi bi-app"></i>
                             ${cluster.applications.join(', ') || 'N/A'}
@@ -253,11 +282,18 @@ async function analyzeCluster(clusterId) {
         });
         const result = await response.json();
 
-        if (result.success) {
-            renderAnalysisResults(result.data);
-            updatePotentialSavings(result.data);
-        } else {
+        if (!result.success) {
             showAnalysisError(result.error || 'Analysis failed');
+            return;
+        }
+
+        // The analysis runs as a background job; poll it until it finishes
+        const job = await waitForJob(result.data.id);
+        if (job.status === 'succeeded') {
+            renderAnalysisResults(job.result);
+            updatePotentialSavings(job.result);
+        } else {
+            showAnalysisError(job.error || 'Analysis failed');
         }
     } catch (error) {
         showAnalysisError('Failed to analyze cluster: ' + error.message);
@@ -268,6 +304,25 @@ async function analyzeCluster(clusterId) {
     }
 }
 
+/**
+ * Poll a background job until it succeeds or fails, and return it
+ */
+async function waitForJob(jobId) {
+    while (true) {
+        const response = await fetch(`/api/jobs/${jobId}`, { cache: 'no-store' });
+        const result = await response.json();
+
+        if (!result.success) {
+            return { status: 'failed', error: result.error };
+        }
+        if (result.data.status === 'succeeded' || result.data.status === 'failed') {
+            return result.data;
+        }
+
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+}
+
 /**
  * Show analysis loading state in modal
  */
@@ -333,6 +388,16 @@ function renderAnalysisResults(analysis) {
                             <td class="text-muted">Analysis Period</td>
                             <td class="text-end">${formatAnalysisPeriod(analysis.analysis_period)}</td>
                         </tr>
+                        ${analysis.metric_period_seconds ? `
+                        <tr>
+                            <td class="text-muted">Metric Resolution</td>
+                            <td class="text-end">${analysis.metric_period_seconds / 60} min</td>
+                        </tr>` : ''}
+                        ${analysis.cache && analysis.cache.hit ? `
+                        <tr>
+                            <td class="text-muted">Result</td>
+                            <td class="text-end">Cached ${Math.round(analysis.cache.age_seconds)}s ago</td>
+                        </tr>` : ''}
                     </table>
                 </div>
             </div>
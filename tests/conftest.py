@@ -0,0 +1,7 @@
+"""
+Test configuration: makes the application modules (config, services) importable from tests/
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
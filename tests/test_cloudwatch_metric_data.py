@@ -0,0 +1,298 @@
+"""
+Tests for GetMetricData collection in CloudWatchService ('batch' and 'search' modes) against a stubbed client
+"""
+import re
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import config
+from services.cloudwatch_service import CloudWatchService
+from services.metric_cache import MetricCache
+from services.rollup_store import RollupStore
+
+
+PERIOD = 300
+# Recent enough for the metric cache to keep, old enough to be settled
+END_TIME = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+START_TIME = END_TIME - timedelta(hours=2)
+TIMESTAMPS = [START_TIME + timedelta(seconds=PERIOD * index) for index in range(24)]
+INSTANCE_IDS = ['i-0a1b2c3d4e5f00001', 'i-0a1b2c3d4e5f00002', 'i-0a1b2c3d4e5f00003']
+UNREQUESTED_INSTANCE_ID = 'i-0ffffffffffffffff'
+STATISTIC_OFFSETS = {'Average': 0.0, 'Maximum': 2.5, 'Minimum': -2.5}
+
+SEARCH_PATTERN = re.compile(
+    r"SEARCH\('\{(?P<namespace>[^,]+),InstanceId\} MetricName=\"(?P<metric>[^\"]+)\" \((?P<filter>.*)\)', "
+    r"'(?P<statistic>\w+)', (?P<period>\d+)\)$"
+)
+
+
+def metric_value(instance_id: str, metric_name: str, timestamp: datetime, statistic: str) -> float:
+    """Value of a stubbed series datapoint"""
+    base = (sum(map(ord, instance_id + metric_name)) + timestamp.hour * 60 + timestamp.minute) % 90 + 5
+    return base + STATISTIC_OFFSETS[statistic]
+
+
+class StubCloudWatchClient:
+    """
+    GetMetricData stub. MetricStat queries return their instance's series; SEARCH expressions return
+    a series labelled with the InstanceId for every instance they name, plus one that was not asked for.
+    Pages hold at most max_datapoints_per_page datapoints (CloudWatch caps pages at 100,800), so series
+    are split across pages and the client has to follow NextToken.
+    """
+
+    def __init__(self, max_datapoints_per_page: int = 50, failed_instance_ids: tuple = ()):
+        self.max_datapoints_per_page = max_datapoints_per_page
+        self.failed_instance_ids = set(failed_instance_ids)
+        self.requests = []
+
+    def get_paginator(self, operation_name: str):
+        assert operation_name == 'get_metric_data'
+        return self
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = self.get_metric_data(**kwargs, **({'NextToken': token} if token else {}))
+            yield page
+            token = page.get('NextToken')
+            if not token:
+                break
+
+    def get_metric_data(self, MetricDataQueries, StartTime, EndTime, ScanBy, NextToken=None):
+        self.requests.append({
+            'queries': MetricDataQueries, 'start': StartTime, 'end': EndTime, 'next_token': NextToken
+        })
+
+        # Every datapoint of the request in order: (query id, label, status, timestamp, value)
+        datapoints = []
+        for query in MetricDataQueries:
+            for label, metric_name, statistic in self._query_series(query):
+                if label in self.failed_instance_ids:
+                    datapoints.append((query['Id'], label, 'InternalError', None, None))
+                    continue
+                for timestamp in TIMESTAMPS:
+                    if StartTime <= timestamp < EndTime:
+                        value = metric_value(label, metric_name, timestamp, statistic)
+                        datapoints.append((query['Id'], label, 'Complete', timestamp, value))
+
+        offset = int(NextToken or 0)
+        page_datapoints = datapoints[offset:offset + self.max_datapoints_per_page]
+        has_more = offset + self.max_datapoints_per_page < len(datapoints)
+
+        results = {}
+        for query_id, label, status, timestamp, value in page_datapoints:
+            result = results.setdefault((query_id, label), {
+                'Id': query_id,
+                'Label': label,
+                'Timestamps': [],
+                'Values': [],
+                'StatusCode': 'PartialData' if has_more and status == 'Complete' else status
+            })
+            if timestamp is not None:
+                result['Timestamps'].append(timestamp)
+                result['Values'].append(value)
+
+        page = {'MetricDataResults': list(results.values()), 'Messages': []}
+        if has_more:
+            page['NextToken'] = str(offset + self.max_datapoints_per_page)
+        return page
+
+    @staticmethod
+    def _query_series(query: dict) -> list:
+        """(label, metric name, statistic) of every series a query returns"""
+        if 'MetricStat' in query:
+            metric = query['MetricStat']['Metric']
+            return [(metric['Dimensions'][0]['Value'], metric['MetricName'], query['MetricStat']['Stat'])]
+
+        match = SEARCH_PATTERN.match(query['Expression'])
+        assert match, query['Expression']
+        assert query['Label'] == "${PROP('Dim.InstanceId')}"
+        instance_ids = re.findall(r'InstanceId="([^"]+)"', match.group('filter'))
+        return [
+            (instance_id, match.group('metric'), match.group('statistic'))
+            for instance_id in instance_ids + [UNREQUESTED_INSTANCE_ID]
+        ]
+
+
+def expected_datapoints(instance_id: str, metric_key: str) -> list:
+    """Datapoints the service should return for a stubbed series"""
+    metric_name = {'cpu': config.CPU_METRIC_NAME, 'memory': config.MEMORY_METRIC_NAME}[metric_key]
+    return [
+        {'Timestamp': timestamp, **{
+            statistic: metric_value(instance_id, metric_name, timestamp, statistic)
+            for statistic in STATISTIC_OFFSETS
+        }}
+        for timestamp in TIMESTAMPS
+    ]
+
+
+@pytest.fixture
+def make_service(monkeypatch):
+    """Build a CloudWatchService in a collection mode, with the stubbed client and no persistent stores"""
+    monkeypatch.setattr(config, 'METRIC_CACHE_ENABLED', False)
+    monkeypatch.setattr(config, 'METRIC_ROLLUPS_ENABLED', False)
+
+    def make(
+        mode: str,
+        client: StubCloudWatchClient,
+        metric_cache: MetricCache = None,
+        rollup_store: RollupStore = None
+    ) -> CloudWatchService:
+        monkeypatch.setattr(config, 'CLOUDWATCH_COLLECTION_MODE', mode)
+        service = CloudWatchService(metric_cache=metric_cache, rollup_store=rollup_store)
+        service.cloudwatch_client = client
+        return service
+
+    return make
+
+
+def test_search_maps_labelled_series_back_to_instances(make_service):
+    client = StubCloudWatchClient()
+    service = make_service('search', client)
+    series_keys = service._series_keys(INSTANCE_IDS)
+
+    datapoints = service._get_batched_series_datapoints(series_keys, START_TIME, END_TIME, PERIOD)
+
+    assert set(datapoints) == set(series_keys)
+    for instance_id, metric_key in series_keys:
+        assert datapoints[(instance_id, metric_key)] == expected_datapoints(instance_id, metric_key)
+
+
+def test_search_follows_next_token_across_pages(make_service):
+    client = StubCloudWatchClient(max_datapoints_per_page=50)
+    service = make_service('search', client)
+
+    datapoints = service._get_batched_series_datapoints(
+        service._series_keys(INSTANCE_IDS), START_TIME, END_TIME, PERIOD
+    )
+
+    # 2 metrics x 3 statistics x 4 labelled series x 24 datapoints, 50 per page
+    assert [request['next_token'] for request in client.requests] == [None] + [str(50 * page) for page in range(1, 12)]
+    # Every page repeats the same queries
+    assert all(request['queries'] == client.requests[0]['queries'] for request in client.requests)
+    assert all(len(series) == len(TIMESTAMPS) for series in datapoints.values())
+
+
+def test_search_uses_fewer_queries_than_batch(make_service):
+    search_client, batch_client = StubCloudWatchClient(), StubCloudWatchClient()
+    search_service = make_service('search', search_client)
+    search_datapoints = search_service._get_batched_series_datapoints(
+        search_service._series_keys(INSTANCE_IDS), START_TIME, END_TIME, PERIOD
+    )
+    batch_service = make_service('batch', batch_client)
+    batch_datapoints = batch_service._get_batched_series_datapoints(
+        batch_service._series_keys(INSTANCE_IDS), START_TIME, END_TIME, PERIOD
+    )
+
+    assert search_datapoints == batch_datapoints
+    # One expression per metric and statistic instead of one query per instance, metric and statistic
+    assert len(search_client.requests[0]['queries']) == 2 * 3
+    assert len(batch_client.requests[0]['queries']) == len(INSTANCE_IDS) * 2 * 3
+
+
+def test_failed_query_status_is_not_cached(make_service, tmp_path):
+    failed_instance_id = INSTANCE_IDS[1]
+    client = StubCloudWatchClient(failed_instance_ids=(failed_instance_id,))
+    metric_cache = MetricCache(str(tmp_path))
+    service = make_service('batch', client, metric_cache)
+
+    datapoints = service._get_batched_series_datapoints(
+        service._series_keys(INSTANCE_IDS), START_TIME, END_TIME, PERIOD
+    )
+
+    assert datapoints[(failed_instance_id, 'cpu')] == []
+    assert datapoints[(INSTANCE_IDS[0], 'cpu')] == expected_datapoints(INSTANCE_IDS[0], 'cpu')
+    # The failed series is fetched again next time; the others are served from the cache
+    failed_key = service._cache_key(failed_instance_id, 'cpu', PERIOD)
+    assert metric_cache.get_missing_ranges(failed_key, START_TIME, END_TIME) == [(START_TIME, END_TIME)]
+    assert metric_cache.get_missing_ranges(service._cache_key(INSTANCE_IDS[0], 'cpu', PERIOD), START_TIME, END_TIME) == []
+
+
+def test_rollups_fetch_each_series_once_and_reuse_stored_hours(make_service, tmp_path):
+    metric_cache, rollup_store = MetricCache(str(tmp_path / 'cache')), RollupStore(str(tmp_path / 'rollups.db'))
+    cold_client = StubCloudWatchClient(max_datapoints_per_page=10000)
+    service = make_service('batch', cold_client, metric_cache, rollup_store)
+
+    cold = service.get_aggregated_metrics_for_instances(INSTANCE_IDS, START_TIME, END_TIME, period=PERIOD)
+
+    # One GetMetricData request per day slice of the window: every series at once, split into hours locally
+    slice_seconds = config.METRIC_ROLLUP_SLICE_SECONDS
+    slices = {int(time.timestamp()) // slice_seconds for time in (START_TIME, END_TIME - timedelta(seconds=1))}
+    assert len(cold_client.requests) == len(slices)
+    assert all(len(request['queries']) == len(INSTANCE_IDS) * 2 * 3 for request in cold_client.requests)
+    assert cold['cpu']['datapoints'] == len(INSTANCE_IDS) * len(TIMESTAMPS)
+    hours = [int(START_TIME.timestamp()) + 3600 * hour for hour in range(2)]
+    stored = rollup_store.get_many({
+        service._cache_key(*series, PERIOD): hours for series in service._series_keys(INSTANCE_IDS)
+    })
+    assert all(sorted(series_hours) == hours for series_hours in stored.values())
+
+    # Settled hours are all rolled up, so nothing is fetched again
+    warm_client = StubCloudWatchClient(max_datapoints_per_page=10000)
+    service.cloudwatch_client = warm_client
+    warm = service.get_aggregated_metrics_for_instances(INSTANCE_IDS, START_TIME, END_TIME, period=PERIOD)
+
+    assert warm_client.requests == []
+    assert warm == cold
+
+
+def test_rollups_fetch_only_the_partial_leading_hour_of_an_unaligned_window(make_service, tmp_path):
+    rollup_store = RollupStore(str(tmp_path / 'rollups.db'))
+    start_time = START_TIME + timedelta(minutes=7)
+    cold_client = StubCloudWatchClient(max_datapoints_per_page=10000)
+    service = make_service('batch', cold_client, rollup_store=rollup_store)
+
+    cold = service.get_aggregated_metrics_for_instances(INSTANCE_IDS, start_time, END_TIME, period=PERIOD)
+
+    # The last hour is settled and rolled up; the first only partly falls inside the window
+    warm_client = StubCloudWatchClient(max_datapoints_per_page=10000)
+    service.cloudwatch_client = warm_client
+    warm = service.get_aggregated_metrics_for_instances(INSTANCE_IDS, start_time, END_TIME, period=PERIOD)
+
+    assert {(request['start'], request['end']) for request in warm_client.requests} == {
+        (start_time, START_TIME + timedelta(hours=1))
+    }
+    assert warm == cold
+
+
+@pytest.mark.parametrize('mode', ['batch', 'search'])
+def test_every_cache_gap_of_a_series_gets_its_datapoints(make_service, tmp_path, mode):
+    client = StubCloudWatchClient(max_datapoints_per_page=10000)
+    metric_cache = MetricCache(str(tmp_path))
+    service = make_service(mode, client, metric_cache)
+    series_keys = service._series_keys(INSTANCE_IDS)
+    # Cache the middle of the window, leaving two gaps of the same series in one aligned window
+    service._get_batched_series_datapoints(
+        series_keys, START_TIME + timedelta(minutes=30), START_TIME + timedelta(minutes=60), PERIOD
+    )
+
+    datapoints = service._get_batched_series_datapoints(series_keys, START_TIME, END_TIME, PERIOD)
+
+    for instance_id, metric_key in series_keys:
+        assert datapoints[(instance_id, metric_key)] == expected_datapoints(instance_id, metric_key)
+        cache_key = service._cache_key(instance_id, metric_key, PERIOD)
+        assert metric_cache.get_missing_ranges(cache_key, START_TIME, END_TIME) == []
+
+
+def test_rollups_stored_at_another_relative_accuracy_are_rebuilt(make_service, tmp_path, monkeypatch):
+    rollup_store = RollupStore(str(tmp_path / 'rollups.db'))
+    service = make_service('batch', StubCloudWatchClient(max_datapoints_per_page=10000), rollup_store=rollup_store)
+    service.get_aggregated_metrics_for_instances(INSTANCE_IDS, START_TIME, END_TIME, period=PERIOD)
+
+    monkeypatch.setattr(config, 'METRIC_ROLLUP_RELATIVE_ACCURACY', 0.02)
+    warm_client = StubCloudWatchClient(max_datapoints_per_page=10000)
+    service.cloudwatch_client = warm_client
+    warm = service.get_aggregated_metrics_for_instances(INSTANCE_IDS, START_TIME, END_TIME, period=PERIOD)
+
+    # Every hour is fetched again and stored at the new accuracy
+    assert min(request['start'] for request in warm_client.requests) == START_TIME
+    assert max(request['end'] for request in warm_client.requests) == END_TIME
+    assert warm['cpu']['datapoints'] == len(INSTANCE_IDS) * len(TIMESTAMPS)
+    hours = [int(START_TIME.timestamp()) + 3600 * hour for hour in range(2)]
+    stored = rollup_store.get_many({
+        service._cache_key(*series, PERIOD): hours for series in service._series_keys(INSTANCE_IDS)
+    })
+    assert all(
+        sketch.relative_accuracy == 0.02 for series_hours in stored.values() for sketch in series_hours.values()
+    )
@@ -0,0 +1,119 @@
+"""
+Tests for MetricSketch: merging, quantile accuracy and threshold counts
+"""
+import json
+import math
+import random
+
+import pytest
+
+import config
+from services.metric_sketch import MetricSketch
+
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+
+
+def utilization_values(count: int = 5000, seed: int = 7) -> list:
+    """Utilization percentages: mostly idle, some busy stretches, a few exact zeros and thresholds"""
+    rng = random.Random(seed)
+    values = [rng.uniform(0.5, 40) if rng.random() < 0.7 else rng.uniform(40, 100) for _ in range(count)]
+    return values + [0.0] * 20 + [float(threshold) for threshold in config.UTILIZATION_THRESHOLDS] * 5
+
+
+def sketch_of(values: list) -> MetricSketch:
+    sketch = MetricSketch(RELATIVE_ACCURACY)
+    for value in values:
+        sketch.add(value, value + 1, max(0.0, value - 1))
+    return sketch
+
+
+def test_merge_matches_a_sketch_of_all_datapoints():
+    values = utilization_values()
+    parts = [values[:1000], values[1000:1001], [], values[1001:]]
+
+    merged = MetricSketch.merged(sketch_of(part) for part in parts)
+    whole = sketch_of(values)
+
+    merged_dict, whole_dict = merged.to_dict(), whole.to_dict()
+    assert merged_dict.pop('sum') == pytest.approx(whole_dict.pop('sum'))
+    assert merged_dict == whole_dict
+
+
+@pytest.mark.parametrize('quantile', [0.0, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 1.0])
+def test_quantiles_are_within_relative_accuracy_of_the_datapoint_at_their_rank(quantile):
+    values = utilization_values()
+    exact = sorted(values)[math.floor(quantile * (len(values) - 1))]
+
+    estimate, = sketch_of(values).quantiles([quantile])
+
+    # Values at or below MIN_INDEXABLE_VALUE are reported as 0
+    assert abs(estimate - exact) <= RELATIVE_ACCURACY * exact + MetricSketch.MIN_INDEXABLE_VALUE
+
+
+@pytest.mark.parametrize('quantile', [0.1, 0.5, 0.85, 0.95])
+def test_quantiles_are_within_relative_accuracy_at_bucket_edges(quantile):
+    # Repeated values just above the lower edges of their buckets (the worst case for interpolation)
+    edges = [GAMMA ** (math.ceil(math.log(value) / math.log(GAMMA)) - 1) for value in (5, 20, 45, 80)]
+    values = sorted(edge * (1 + 1e-9) for edge in edges for _ in range(10)) + [99.0]
+    exact = values[math.floor(quantile * (len(values) - 1))]
+
+    estimate, = sketch_of(values).quantiles([quantile])
+
+    assert abs(estimate - exact) <= RELATIVE_ACCURACY * exact
+
+
+def test_quantiles_are_bounded_by_the_largest_average():
+    sketch = sketch_of([42.0] * 10)
+
+    assert sketch.quantiles([0.5, 1.0]) == [pytest.approx(42.0, rel=RELATIVE_ACCURACY)] * 2
+    assert max(sketch.quantiles([0.5, 1.0])) <= 42.0
+    assert MetricSketch(RELATIVE_ACCURACY).quantiles([0.5]) == [None]
+
+
+def test_count_at_or_above_is_exact_for_thresholds_and_bounded_otherwise():
+    values = utilization_values()
+    sketch = sketch_of(values)
+
+    for threshold in config.UTILIZATION_THRESHOLDS:
+        assert sketch.count_at_or_above(threshold) == sum(1 for v in values if v >= threshold)
+
+    # Elsewhere only the bucket holding the value is estimated
+    for value in (12.3, 55.5, 95.0):
+        assert sum(1 for v in values if v > value * GAMMA) <= sketch.count_at_or_above(value)
+        assert sketch.count_at_or_above(value) <= sum(1 for v in values if v > value / GAMMA)
+    assert sketch.count_at_or_above(0) == len(values)
+
+
+def test_round_trips_through_json():
+    sketch = sketch_of(utilization_values(count=500))
+
+    restored = MetricSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+
+    assert restored.to_dict() == sketch.to_dict()
+    assert restored.quantiles([0.5, 0.95]) == sketch.quantiles([0.5, 0.95])
+
+
+def test_thresholds_missing_from_a_merged_sketch_are_estimated(monkeypatch):
+    values = utilization_values()
+    monkeypatch.setattr(config, 'UTILIZATION_THRESHOLDS', [70])
+    old = sketch_of(values[:2000])
+    monkeypatch.setattr(config, 'UTILIZATION_THRESHOLDS', [70, 80])
+    new = sketch_of(values[2000:])
+
+    merged = MetricSketch.merged([old, new])
+
+    assert merged.count_at_or_above(70) == sum(1 for v in values if v >= 70)
+    assert merged.threshold_counts == {'70': sum(1 for v in values if v >= 70)}
+    assert sum(1 for v in values if v > 80 * GAMMA) <= merged.count_at_or_above(80)
+    assert merged.count_at_or_above(80) <= sum(1 for v in values if v > 80 / GAMMA)
+
+
+def test_sketches_with_different_relative_accuracy_are_not_merged():
+    coarse = MetricSketch(0.02)
+    coarse.add(50.0)
+
+    with pytest.raises(ValueError):
+        sketch_of([10.0, 20.0]).merge(coarse)
+    assert MetricSketch.merged([coarse, MetricSketch(0.02)]).relative_accuracy == 0.02